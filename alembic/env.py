@@ -8,6 +8,7 @@ from alembic import context
 
 
 from models.users import users, access_tokens
+from models.outbox import outbox
 from db import metadata
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
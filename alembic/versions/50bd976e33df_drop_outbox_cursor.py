@@ -0,0 +1,30 @@
+"""drop outbox_cursor
+
+Revision ID: 50bd976e33df
+Revises: df954c64cb85
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '50bd976e33df'
+down_revision = 'df954c64cb85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.drop_table('outbox_cursor')
+
+
+def downgrade() -> None:
+    op.create_table(
+        'outbox_cursor',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('last_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
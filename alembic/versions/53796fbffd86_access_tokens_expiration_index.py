@@ -0,0 +1,29 @@
+"""access_tokens expiration_date index
+
+Revision ID: 53796fbffd86
+Revises: c69553b09ad6
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '53796fbffd86'
+down_revision = 'c69553b09ad6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        op.f('ix_access_tokens_expiration_date'),
+        'access_tokens',
+        ['expiration_date'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_access_tokens_expiration_date'), table_name='access_tokens')
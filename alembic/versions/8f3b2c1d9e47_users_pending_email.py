@@ -0,0 +1,25 @@
+"""users pending_email
+
+Revision ID: 8f3b2c1d9e47
+Revises: 50bd976e33df
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3b2c1d9e47'
+down_revision = '50bd976e33df'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('pending_email', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('pending_email')
@@ -0,0 +1,81 @@
+"""access_tokens expires_at epoch seconds
+
+Revision ID: df954c64cb85
+Revises: 53796fbffd86
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'df954c64cb85'
+down_revision = '53796fbffd86'
+branch_labels = None
+depends_on = None
+
+
+def to_datetime(value) -> datetime:
+    # SQLite returns the stored string, with or without microseconds
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def upgrade() -> None:
+    op.add_column('access_tokens', sa.Column('expires_at', sa.BigInteger(), nullable=True))
+    connection = op.get_bind()
+    # expiration_date was written with naive datetime.now(), timestamp()
+    # treats it as local time as well
+    rows = connection.execute(
+        sa.text('SELECT access_token, expiration_date FROM access_tokens')
+    ).fetchall()
+    for row in rows:
+        connection.execute(
+            sa.text(
+                'UPDATE access_tokens SET expires_at = :expires_at '
+                'WHERE access_token = :access_token'
+            ),
+            {
+                'expires_at': int(to_datetime(row.expiration_date).timestamp()),
+                'access_token': row.access_token,
+            },
+        )
+    with op.batch_alter_table('access_tokens') as batch_op:
+        batch_op.drop_index('ix_access_tokens_expiration_date')
+        batch_op.drop_column('expiration_date')
+        batch_op.alter_column('expires_at', existing_type=sa.BigInteger(), nullable=False)
+        batch_op.create_index('ix_access_tokens_expires_at', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.add_column(
+        'access_tokens', sa.Column('expiration_date', sa.DateTime(), nullable=True)
+    )
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.text('SELECT access_token, expires_at FROM access_tokens')
+    ).fetchall()
+    for row in rows:
+        connection.execute(
+            sa.text(
+                'UPDATE access_tokens SET expiration_date = :expiration_date '
+                'WHERE access_token = :access_token'
+            ),
+            {
+                'expiration_date': datetime.fromtimestamp(row.expires_at),
+                'access_token': row.access_token,
+            },
+        )
+    with op.batch_alter_table('access_tokens') as batch_op:
+        batch_op.drop_index('ix_access_tokens_expires_at')
+        batch_op.drop_column('expires_at')
+        batch_op.alter_column(
+            'expiration_date', existing_type=sa.DateTime(), nullable=False
+        )
+        batch_op.create_index(
+            'ix_access_tokens_expiration_date', ['expiration_date'], unique=False
+        )
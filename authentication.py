@@ -1,13 +1,22 @@
-from typing import Optional, Union
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Union
 
+import sqlalchemy
+from databases import Database
 from fastapi import HTTPException, status
 
-from models.users import AccessToken, access_tokens, users, UserDB
-from password import verify_password
-from db import database
+from models.users import AccessToken, access_tokens, users, UserDB, TokenUser
+from hashing import async_verify_and_update
+from db import get_database, get_db_router
+from cache import token_cache
+from sessions import session_extender
+from tokens import signed_tokens_enabled, token_signer
 
 
 async def authenticate(email: str, password: str) -> UserDB:
+    database = get_database()
     query = "SELECT * FROM users WHERE email = :email"
     user = await database.fetch_one(query=query, values={"email": email})
     if not user:
@@ -18,25 +27,134 @@ async def authenticate(email: str, password: str) -> UserDB:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Unverified account."
         )
-    if not verify_password(password, user.password):
+    verified, new_hash = await async_verify_and_update(password, user.password)
+    if not verified:
         return False
+    if new_hash is not None:
+        # stored hash uses an old scheme or a lower cost
+        query = "UPDATE users SET password = :password WHERE id = :id"
+        await database.execute(query=query, values={"password": new_hash, "id": user.id})
+        logging.info("Password rehashed | user: %s", user.id)
     return UserDB(**user)
 
 
 async def create_access_token(user: UserDB) -> AccessToken:
+    """
+    New access token of the user with the current claims
+    A user has one token at a time, the previous one stops working.
+    """
+    database = get_database()
     token = AccessToken(user_id=user.id)
-    query = """INSERT INTO access_tokens(access_token, user_id, expiration_date)
-           VALUES (:access_token, :user_id, :expiration_date)
+    if signed_tokens_enabled():
+        token_signer.revoke_user(user.id)
+        token.access_token = token_signer.sign(
+            user.id, user.email, user.username, token.expiration_date.timestamp()
+        )
+    query = """INSERT INTO access_tokens(access_token, user_id, expires_at)
+           VALUES (:access_token, :user_id, :expires_at)
            ON CONFLICT (user_id)
-           DO UPDATE SET access_token = :access_token, expiration_date = :expiration_date"""
+           DO UPDATE SET access_token = :access_token, expires_at = :expires_at
+           RETURNING access_token, user_id, expires_at"""
     values = {
         "access_token": token.access_token,
         "user_id": token.user_id,
-        "expiration_date": token.expiration_date,
+        "expires_at": int(token.expiration_date.timestamp()),
     }
-    await database.execute(query=query, values=values)
-    refresh_query = "SELECT * FROM access_tokens WHERE access_token = :access_token"
-    refresh_token_db = await database.fetch_one(
-        query=refresh_query, values={"access_token": token.access_token}
+    refresh_token_db = await database.fetch_one(query=query, values=values)
+    token_cache.invalidate_user(user.id)
+    get_db_router().mark_write(refresh_token_db.access_token)
+    return AccessToken(
+        access_token=refresh_token_db.access_token,
+        user_id=refresh_token_db.user_id,
+        expiration_date=datetime.fromtimestamp(refresh_token_db.expires_at),
+    )
+
+
+def verify_signed_token(token: str) -> Optional[TokenUser]:
+    claims = token_signer.verify(token)
+    if claims is None:
+        return None
+    return TokenUser(
+        id=claims["sub"],
+        email=claims["email"],
+        username=claims["username"],
+        access_token=token,
+        expiration_date=datetime.fromtimestamp(claims["exp"]),
+    )
+
+
+async def resolve_tokens(
+    database: Database, tokens: List[str]
+) -> Dict[str, Optional[TokenUser]]:
+    """
+    Resolve access tokens to users, None for unknown or expired tokens
+    Signed tokens are verified locally, cached tokens are served from
+    token_cache, the rest is fetched with one access_tokens query.
+    Resolved opaque tokens count as activity for sliding sessions.
+    """
+    result: Dict[str, Optional[TokenUser]] = {}
+    missing = []
+    for token in tokens:
+        if signed_tokens_enabled() and token_signer.is_signed(token):
+            result[token] = verify_signed_token(token)
+            continue
+        cached_user = token_cache.get(token)
+        if cached_user is not None:
+            result[token] = cached_user
+            session_extender.touch(cached_user)
+        else:
+            result[token] = None
+            missing.append(token)
+    if not missing:
+        return result
+    found = await fetch_token_users(database, missing)
+    unresolved = [token for token in missing if token not in found]
+    if unresolved and database is not get_db_router().primary:
+        # a token issued a moment ago may not have reached the replica yet
+        found.update(await fetch_token_users(get_db_router().primary, unresolved))
+    for current_user in found.values():
+        session_extender.touch(current_user)
+    result.update(found)
+    return result
+
+
+async def fetch_token_users(
+    database: Database, tokens: List[str]
+) -> Dict[str, TokenUser]:
+    """
+    Valid tokens with their users, one access_tokens query
+    Only primary reads are cached: a lagging replica may return a user
+    changed a moment ago on another worker, the cache is shared.
+    """
+    query = sqlalchemy.text(
+        """
+        SELECT access_tokens.expires_at, access_tokens.access_token, users.id, users.email, users.username
+        FROM access_tokens
+        JOIN users ON access_tokens.user_id = users.id
+        WHERE access_token IN :access_tokens AND access_tokens.expires_at > :now
+        """
+    ).bindparams(
+        sqlalchemy.bindparam("access_tokens", tokens, expanding=True),
+        now=int(time.time()),
     )
-    return AccessToken(**refresh_token_db)
+    result: Dict[str, TokenUser] = {}
+    # before the query, so an invalidation during it wins
+    read_at = time.time()
+    for user_db in await database.fetch_all(query):
+        current_user = TokenUser(
+            id=user_db.id,
+            email=user_db.email,
+            username=user_db.username,
+            access_token=user_db.access_token,
+            expiration_date=datetime.fromtimestamp(user_db.expires_at),
+        )
+        if database is get_db_router().primary:
+            token_cache.set(
+                current_user.access_token,
+                current_user,
+                current_user.id,
+                user_db.expires_at,
+                cached_at=read_at,
+            )
+        result[current_user.access_token] = current_user
+    return result
@@ -0,0 +1,362 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from db import shared_file_path
+from metrics import TOKEN_CACHE_REQUESTS
+from models.users import TokenUser
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of access_token -> current user with TTL
+    Entries never outlive the token expiration_date.
+    The cache is per process, so other workers see an invalidation
+    only after token_cache_ttl seconds, see SharedTokenCache.
+    """
+
+    def __init__(self, max_size: int, ttl: int) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._user_tokens: Dict[int, Set[str]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, token: str) -> Optional[Any]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            TOKEN_CACHE_REQUESTS.labels("miss").inc()
+            return None
+        expires_at, _, value = entry
+        if expires_at <= time.time():
+            self.invalidate(token)
+            self.misses += 1
+            TOKEN_CACHE_REQUESTS.labels("miss").inc()
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        TOKEN_CACHE_REQUESTS.labels("hit").inc()
+        return value
+
+    def set(
+        self,
+        token: str,
+        value: Any,
+        user_id: int,
+        expires_at: float,
+        cached_at: Optional[float] = None,
+    ) -> None:
+        """
+        Cache value until min(cached_at + ttl, expires_at), epoch seconds
+        cached_at is when value was read, now by default.
+        """
+        if not self.enabled:
+            return
+        if cached_at is None:
+            cached_at = time.time()
+        expires_at = min(cached_at + self.ttl, expires_at)
+        self.invalidate(token)
+        self._entries[token] = (expires_at, user_id, value)
+        self._user_tokens.setdefault(user_id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            old_token, (_, old_user_id, _) = self._entries.popitem(last=False)
+            self._discard_user_token(old_user_id, old_token)
+            self.evictions += 1
+
+    def invalidate(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            self._discard_user_token(entry[1], token)
+
+    def invalidate_user(self, user_id: int) -> None:
+        for token in self._user_tokens.pop(user_id, set()):
+            self._entries.pop(token, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._user_tokens.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _discard_user_token(self, user_id: int, token: str) -> None:
+        tokens = self._user_tokens.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._user_tokens[user_id]
+
+
+MAGIC: bytes = b"TKC1"
+# magic, buckets, ways, user slots
+HEADER: struct.Struct = struct.Struct("<4sQBxxxQ")
+HEADER_SIZE: int = 64
+WAYS: int = 4
+# version, key, user_id, cached_at, cached_until, expires_at, email, username
+RECORD: struct.Struct = struct.Struct("<I4x16sqddd128p64p")
+RECORD_SIZE: int = 256
+VERSION: struct.Struct = struct.Struct("<I")
+USER_SLOT: struct.Struct = struct.Struct("<d")
+
+
+class SharedTokenCache:
+    """
+    Token cache in a file mmapped by all workers on the host
+    Same interface as TokenCache, values are TokenUser.
+    A set-associative hash table of fixed-size records: the bucket is
+    picked by the token digest, the oldest of its WAYS records is replaced.
+    Writers hold flock on the file, readers take no lock and retry-free
+    detect torn records by the record version (odd while written).
+    invalidate_user stamps the user slot, records of the user cached
+    before the stamp are misses; users sharing a slot only lose cache hits.
+    """
+
+    def __init__(self, path: str, max_size: int, ttl: int) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.buckets = max(1, math.ceil(max_size / WAYS))
+        self.user_slots = max(1, max_size)
+        self.path = shared_file_path(path, MAGIC, self.buckets, WAYS, self.user_slots)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._file: Any = None
+        self._map: Optional[mmap.mmap] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    @property
+    def _records_offset(self) -> int:
+        return HEADER_SIZE + self.user_slots * USER_SLOT.size
+
+    def open(self) -> mmap.mmap:
+        """
+        Map the file, once per process (gunicorn forks after import)
+        The layout is in the file name, a file in use is never resized.
+        """
+        if self._map is not None and self._pid == os.getpid():
+            return self._map
+        length = self._records_offset + self.buckets * WAYS * RECORD_SIZE
+        expected = HEADER.pack(MAGIC, self.buckets, WAYS, self.user_slots)
+        descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(descriptor, "r+b")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            if os.fstat(descriptor).st_size == 0:
+                self._file.truncate(length)
+                self._file.write(expected)
+                self._file.flush()
+            elif (
+                self._file.read(HEADER.size) != expected
+                or os.fstat(descriptor).st_size != length
+            ):
+                raise ValueError(f"{self.path} is not a token cache of this layout")
+            self._map = mmap.mmap(descriptor, length)
+            self._pid = os.getpid()
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        return self._map
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def _key(self, token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def _slots(self, key: bytes) -> range:
+        bucket = int.from_bytes(key[:8], "little") % self.buckets
+        start = self._records_offset + bucket * WAYS * RECORD_SIZE
+        return range(start, start + WAYS * RECORD_SIZE, RECORD_SIZE)
+
+    def _user_offset(self, user_id: int) -> int:
+        return HEADER_SIZE + user_id % self.user_slots * USER_SLOT.size
+
+    def _read(self, cache: mmap.mmap, offset: int) -> Optional[tuple]:
+        version = VERSION.unpack_from(cache, offset)[0]
+        if version % 2:
+            return None
+        record = RECORD.unpack_from(cache, offset)
+        if VERSION.unpack_from(cache, offset)[0] != version:
+            return None
+        return record
+
+    def get(self, token: str) -> Optional[TokenUser]:
+        if not self.enabled:
+            return None
+        cache = self.open()
+        key = self._key(token)
+        now = time.time()
+        for offset in self._slots(key):
+            record = self._read(cache, offset)
+            if record is None or record[1] != key:
+                continue
+            _, _, user_id, cached_at, cached_until, expires_at, email, username = record
+            invalidated_at = USER_SLOT.unpack_from(cache, self._user_offset(user_id))[0]
+            if cached_until <= now or cached_at <= invalidated_at:
+                break
+            self.hits += 1
+            TOKEN_CACHE_REQUESTS.labels("hit").inc()
+            return TokenUser(
+                id=user_id,
+                email=email.decode(),
+                username=username.decode(),
+                access_token=token,
+                expiration_date=datetime.fromtimestamp(expires_at),
+            )
+        self.misses += 1
+        TOKEN_CACHE_REQUESTS.labels("miss").inc()
+        return None
+
+    def _write(self, cache: mmap.mmap, offset: int, record: Optional[tuple]) -> None:
+        version = VERSION.unpack_from(cache, offset)[0]
+        VERSION.pack_into(cache, offset, version + 1)
+        if record is None:
+            cache[offset + VERSION.size : offset + RECORD_SIZE] = bytes(
+                RECORD_SIZE - VERSION.size
+            )
+        else:
+            RECORD.pack_into(cache, offset, version + 1, *record)
+        VERSION.pack_into(cache, offset, version + 2)
+
+    def set(
+        self,
+        token: str,
+        value: TokenUser,
+        user_id: int,
+        expires_at: float,
+        cached_at: Optional[float] = None,
+    ) -> None:
+        """
+        Cache value until min(cached_at + ttl, expires_at), epoch seconds
+        cached_at is when value was read, now by default: a user invalidated
+        after the read is never cached.
+        Users with email or username too long for a record are not cached.
+        """
+        if not self.enabled:
+            return
+        email = value.email.encode()
+        username = value.username.encode()
+        if len(email) > 127 or len(username) > 63:
+            return
+        cache = self.open()
+        key = self._key(token)
+        now = time.time()
+        if cached_at is None:
+            cached_at = now
+        record = (
+            key,
+            user_id,
+            cached_at,
+            min(cached_at + self.ttl, expires_at),
+            expires_at,
+            email,
+            username,
+        )
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            victim = None
+            oldest = math.inf
+            for offset in self._slots(key):
+                current = RECORD.unpack_from(cache, offset)
+                if current[1] == key or current[4] <= now:
+                    victim = offset
+                    break
+                if current[4] < oldest:
+                    victim, oldest = offset, current[4]
+            else:
+                self.evictions += 1
+            self._write(cache, victim, record)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def invalidate(self, token: str) -> None:
+        if not self.enabled:
+            return
+        cache = self.open()
+        key = self._key(token)
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            for offset in self._slots(key):
+                if RECORD.unpack_from(cache, offset)[1] == key:
+                    self._write(cache, offset, None)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def invalidate_user(self, user_id: int) -> None:
+        if not self.enabled:
+            return
+        cache = self.open()
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            USER_SLOT.pack_into(cache, self._user_offset(user_id), time.time())
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def clear(self) -> None:
+        cache = self.open()
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            cache[HEADER_SIZE:] = bytes(len(cache) - HEADER_SIZE)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        """
+        size scans the table, hits/misses/evictions are of this process
+        """
+        cache = self.open()
+        now = time.time()
+        size = 0
+        for offset in range(self._records_offset, len(cache), RECORD_SIZE):
+            if RECORD.unpack_from(cache, offset)[4] > now:
+                size += 1
+        return {
+            "size": size,
+            "max_size": self.buckets * WAYS,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def get_token_cache() -> Any:
+    if settings.token_cache_backend == "shared":
+        return SharedTokenCache(
+            settings.token_cache_path,
+            settings.token_cache_size,
+            settings.token_cache_ttl,
+        )
+    return TokenCache(settings.token_cache_size, settings.token_cache_ttl)
+
+
+token_cache: Any = get_token_cache()
@@ -1,15 +1,32 @@
+import asyncio
+import hashlib
+import itertools
+import logging
 import os
-from typing import Any, Type
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Type
 
 import sqlalchemy
+from fastapi import Header, HTTPException, status
 from sqlalchemy.engine.base import Engine
 from sqlalchemy.sql.schema import MetaData
 
-from databases import Database
-from settings import Settings
+from databases import Database, DatabaseURL
+from metrics import (
+    DB_POOL_ACQUIRE_DURATION,
+    DB_POOL_IN_USE,
+    DB_POOL_TIMEOUTS,
+    DB_POOL_WAITING,
+    observe_query,
+)
+from query_profiler import query_profiler
+from settings import Settings, get_settings
 
 
-settings: Settings = Settings()
+settings: Settings = get_settings()
 
 
 TESTING = os.getenv("TEST")
@@ -17,23 +34,418 @@ TESTING = os.getenv("TEST")
 TEST_DATABASE_URL: str = str(settings.database_test)
 DATABASE_URL: str = str(settings.database_sqlite)
 
-if TESTING == "test":
-    print("TEST")
-    database: Any = Database(TEST_DATABASE_URL)
-    sqlalchemy_engine: Engine = sqlalchemy.create_engine(
-        TEST_DATABASE_URL,
-    )  # connect_args={"check_same_thread": False}
-else:
-    database: Any = Database(DATABASE_URL)
-    sqlalchemy_engine: Engine = sqlalchemy.create_engine(
-        DATABASE_URL
-    )  # connect_args={"check_same_thread": False}
 
+def sqlite_pragmas() -> List[str]:
+    """
+    Performance profile applied to every SQLite connection
+    """
+    return [
+        f"PRAGMA journal_mode={settings.sqlite_journal_mode}",
+        f"PRAGMA synchronous={settings.sqlite_synchronous}",
+        f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}",
+        f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}",
+        f"PRAGMA cache_size={int(settings.sqlite_cache_size)}",
+    ]
+
+
+def apply_sqlite_pragmas(connection: Any, *args: Any) -> None:
+    cursor = connection.cursor()
+    for pragma in sqlite_pragmas():
+        cursor.execute(pragma)
+    cursor.close()
+
+
+class PragmaConnection(sqlite3.Connection):
+    """
+    sqlite3 connection factory for aiosqlite, runs the pragma profile on connect
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        apply_sqlite_pragmas(self)
+
+
+def database_options(url: str) -> dict:
+    """
+    Pool and driver options for Database(url, **options)
+    """
+    if DatabaseURL(url).dialect == "sqlite":
+        # aiosqlite opens a connection per acquire, options go to sqlite3.connect
+        return {
+            "factory": PragmaConnection,
+            "timeout": settings.sqlite_busy_timeout / 1000,
+            "cached_statements": settings.db_statement_cache_size,
+        }
+    return {
+        "min_size": settings.db_pool_min_size,
+        "max_size": settings.db_pool_max_size,
+        "statement_cache_size": settings.db_statement_cache_size,
+    }
+
+
+def create_engine(url: str) -> Engine:
+    engine = sqlalchemy.create_engine(url)
+    if engine.dialect.name == "sqlite":
+        sqlalchemy.event.listen(engine, "connect", apply_sqlite_pragmas)
+    return engine
+
+
+class InstrumentedDatabase:
+    """
+    Database proxy which times every query and reports it to observers
+    observer(method, query, values, seconds, error)
+    At most max_size queries run at once, the rest wait up to
+    acquire_timeout seconds and then get 503.
+    """
+
+    def __init__(
+        self, database: Database, max_size: int = 10, acquire_timeout: float = 10.0
+    ) -> None:
+        self._database = database
+        self.observers: List[Callable] = []
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.in_use = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.max_wait_seconds = 0.0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._database, name)
+
+    def add_observer(self, observer: Callable) -> None:
+        self.observers.append(observer)
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncGenerator[None, None]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_size)
+        start = time.perf_counter()
+        self.waiting += 1
+        DB_POOL_WAITING.inc()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            DB_POOL_TIMEOUTS.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Database is busy, try again later.",
+            )
+        finally:
+            self.waiting -= 1
+            DB_POOL_WAITING.dec()
+        waited = time.perf_counter() - start
+        self.acquired += 1
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        DB_POOL_ACQUIRE_DURATION.observe(waited)
+        self.in_use += 1
+        DB_POOL_IN_USE.inc()
+        try:
+            yield
+        finally:
+            self.in_use -= 1
+            DB_POOL_IN_USE.dec()
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.max_size,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "max_wait_ms": self.max_wait_seconds * 1000,
+        }
+
+    def _notify(
+        self, method: str, query: Any, values: Optional[dict], start: float, error: bool
+    ) -> None:
+        elapsed = time.perf_counter() - start
+        for observer in self.observers:
+            observer(method, query, values, elapsed, error)
+
+    async def _timed(
+        self, method: str, query: Any, values: Optional[dict], *args: Any
+    ) -> Any:
+        async with self._slot():
+            start = time.perf_counter()
+            error = False
+            try:
+                return await getattr(self._database, method)(query, values, *args)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self._notify(method, query, values, start, error)
+
+    async def fetch_all(self, query: Any, values: Optional[dict] = None) -> Any:
+        return await self._timed("fetch_all", query, values)
+
+    async def fetch_one(self, query: Any, values: Optional[dict] = None) -> Any:
+        return await self._timed("fetch_one", query, values)
+
+    async def fetch_val(
+        self, query: Any, values: Optional[dict] = None, column: Any = 0
+    ) -> Any:
+        return await self._timed("fetch_val", query, values, column)
+
+    async def execute(self, query: Any, values: Optional[dict] = None) -> Any:
+        return await self._timed("execute", query, values)
+
+    async def execute_many(self, query: Any, values: list) -> None:
+        async with self._slot():
+            start = time.perf_counter()
+            error = False
+            try:
+                await self._database.execute_many(query, values)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self._notify("execute_many", query, None, start, error)
+
+    async def iterate(
+        self, query: Any, values: Optional[dict] = None
+    ) -> AsyncGenerator[Any, None]:
+        """
+        Time and the connection slot cover the whole iteration
+        """
+        async with self._slot():
+            start = time.perf_counter()
+            error = False
+            try:
+                async for record in self._database.iterate(query, values):
+                    yield record
+            except Exception:
+                error = True
+                raise
+            finally:
+                self._notify("iterate", query, values, start, error)
+
+
+def create_database(url: str) -> "InstrumentedDatabase":
+    return InstrumentedDatabase(
+        Database(url, **database_options(url)),
+        max_size=settings.db_pool_max_size,
+        acquire_timeout=settings.db_acquire_timeout,
+    )
+
+
+def database_url() -> str:
+    """
+    Primary database url, the test database with TEST=test
+    """
+    return TEST_DATABASE_URL if TESTING == "test" else DATABASE_URL
+
+
+def replica_urls() -> List[str]:
+    return [url.strip() for url in settings.database_replicas.split(",") if url.strip()]
+
+
+def shared_file_path(path: str, *layout: Any) -> str:
+    """
+    path of a file shared by the workers of this app instance, suffixed with
+    a digest of the database url and the file layout: instances on other
+    databases or with another layout never map the same file
+    """
+    key = repr((database_url(), *layout)).encode()
+    return f"{path}.{hashlib.blake2b(key, digest_size=8).hexdigest()}"
+
+
+@lru_cache()
+def get_engine() -> Engine:
+    """
+    Sync engine of the primary for the outbox relay and schema creation,
+    created on first use, the web workers never need it
+    """
+    return create_engine(database_url())
+
+
+class DatabaseRouter:
+    """
+    Writes go to the primary, reads to healthy replicas (round robin)
+    A session (access token) reads from the primary for sticky_seconds
+    after its last write, so it sees its own changes despite replica lag.
+    Stickiness is per process, so replica reads never fill the shared token
+    cache (see fetch_token_users). Replicas join healthy once they connect
+    and respond, an unreachable one does not stop startup.
+    """
+
+    def __init__(
+        self,
+        primary: InstrumentedDatabase,
+        replicas: List[InstrumentedDatabase],
+        sticky_seconds: float,
+        health_interval: float,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas
+        self.sticky_seconds = sticky_seconds
+        self.health_interval = health_interval
+        self.healthy: List[InstrumentedDatabase] = []
+        self.primary_reads = 0
+        self.replica_reads = 0
+        self._next = itertools.count()
+        self._last_write: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def databases(self) -> List[InstrumentedDatabase]:
+        return [self.primary, *self.replicas]
+
+    def reader(self, session: Optional[str] = None) -> InstrumentedDatabase:
+        if session is not None and session in self._last_write:
+            if self._last_write[session] > time.monotonic() - self.sticky_seconds:
+                self.primary_reads += 1
+                return self.primary
+            del self._last_write[session]
+        if not self.healthy:
+            self.primary_reads += 1
+            return self.primary
+        self.replica_reads += 1
+        return self.healthy[next(self._next) % len(self.healthy)]
+
+    def mark_write(self, session: str) -> None:
+        # without replicas every read is on the primary, nothing to remember
+        if self.replicas:
+            self._last_write[session] = time.monotonic()
+
+    async def check_replicas(self) -> None:
+        healthy = []
+        for replica in self.replicas:
+            try:
+                if not replica.is_connected:
+                    await asyncio.wait_for(replica.connect(), self.health_interval)
+                await asyncio.wait_for(
+                    replica.fetch_val("SELECT 1"), self.health_interval
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                if replica in self.healthy:
+                    logging.warning(
+                        "Replica is down | %s, error: %r", replica.url, error
+                    )
+                continue
+            if replica not in self.healthy:
+                logging.info("Replica is up | %s", replica.url)
+            healthy.append(replica)
+        self.healthy = healthy
+        expired = time.monotonic() - self.sticky_seconds
+        self._last_write = {
+            session: written
+            for session, written in self._last_write.items()
+            if written > expired
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_replicas()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Replica health check failed")
+
+    async def connect(self) -> None:
+        await self.primary.connect()
+        if self.replicas:
+            # replicas are connected by the health check
+            await self.check_replicas()
+            if self._task is None:
+                self._task = asyncio.create_task(self._run())
+
+    async def disconnect(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for connection in self.databases:
+            if connection.is_connected:
+                await connection.disconnect()
+
+    def stats(self) -> dict:
+        return {
+            "replicas": len(self.replicas),
+            "healthy": len(self.healthy),
+            "primary_reads": self.primary_reads,
+            "replica_reads": self.replica_reads,
+            "sticky_sessions": len(self._last_write),
+        }
+
+
+@lru_cache()
+def get_db_router() -> DatabaseRouter:
+    """
+    Primary and replicas of the process, created on first use like
+    get_settings, importing db opens nothing
+    """
+    if TESTING == "test":
+        print("TEST")
+    databases = [create_database(url) for url in [database_url(), *replica_urls()]]
+    for connection in databases:
+        connection.add_observer(observe_query)
+        if settings.query_profiler:
+            query_profiler.attach(connection)
+    return DatabaseRouter(
+        databases[0],
+        databases[1:],
+        sticky_seconds=settings.replica_sticky_seconds,
+        health_interval=settings.replica_health_interval,
+    )
+
+
+def integrity_errors(urls: List[str]) -> tuple:
+    """
+    Unique constraint violations raised by the drivers of the databases,
+    asyncpg is imported only when a postgres database is configured
+    """
+    errors: List[Type[Exception]] = [sqlite3.IntegrityError]
+    if any(DatabaseURL(url).dialect == "postgresql" for url in urls):
+        import asyncpg.exceptions  # pylint: disable=import-outside-toplevel
+
+        errors.append(asyncpg.exceptions.UniqueViolationError)
+    return tuple(errors)
+
+
+INTEGRITY_ERRORS: tuple = integrity_errors([database_url(), *replica_urls()])
 
 metadata: MetaData = sqlalchemy.MetaData()
-metadata.create_all(sqlalchemy_engine)
+
+
+def create_schema() -> None:
+    """
+    Create missing tables, for development and tests
+    Deployments migrate with alembic upgrade head instead.
+    """
+    # tables register on metadata when their models are imported
+    import models.outbox  # pylint: disable=import-outside-toplevel,unused-import
+    import models.users  # pylint: disable=import-outside-toplevel,unused-import
+
+    metadata.create_all(get_engine())
 
 
 # Dependency
 def get_database() -> Database:
-    return database
+    """
+    InstrumentedDatabase: metrics and, with query_profiler, the slow query log
+    """
+    return get_db_router().primary
+
+
+def session_key(authorization: Optional[str]) -> Optional[str]:
+    if authorization and authorization.startswith("Bearer "):
+        return authorization[7:]
+    return authorization
+
+
+def get_read_database(
+    authorization: Optional[str] = Header(default=None),
+) -> Database:
+    """
+    Replica for read-only endpoints, primary right after the session wrote
+    """
+    return get_db_router().reader(session_key(authorization))
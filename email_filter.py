@@ -0,0 +1,239 @@
+import asyncio
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import random
+import struct
+import time
+from typing import Any, Iterable, List, Optional
+
+from databases import Database
+
+from db import shared_file_path
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+MAGIC: bytes = b"EMBF"
+# magic, active buffer, hash count, buffer size, rebuilt_at
+HEADER: struct.Struct = struct.Struct("<4sBBxxQd")
+HEADER_SIZE: int = 64
+ACTIVE_OFFSET: int = 4
+REBUILT_AT_OFFSET: int = 16
+
+
+def filter_size(capacity: int, error_rate: float) -> tuple:
+    """
+    Bloom filter bits and hash count for capacity items at error_rate
+    """
+    size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(size / capacity * math.log(2)))
+    return size, hashes
+
+
+class EmailFilter:
+    """
+    Bloom filter of registered emails in a file mmapped by all workers
+    might_contain False - the email is new, skip the duplicate check before
+    hashing. Never deny on it, the unique index has the last word.
+    One byte per bit, so concurrent writers never lose each other's bits.
+    Two buffers: add() writes both, rebuild() refills the inactive one
+    from users and switches, so rebuilding never drops new emails.
+    Users inserted outside the app are seen after the next rebuild, every
+    worker rebuilds on start and then each rebuild_interval.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        capacity: int,
+        error_rate: float,
+        rebuild_interval: float,
+        enabled: bool,
+    ) -> None:
+        self.enabled = enabled
+        self.rebuild_interval = rebuild_interval
+        self.size, self.hashes = filter_size(capacity, error_rate)
+        self.path = shared_file_path(path, MAGIC, self.size, self.hashes)
+        self.rebuilds = 0
+        self.short_circuits = 0
+        self._file: Any = None
+        self._map: Optional[mmap.mmap] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def open(self) -> None:
+        """
+        Map the file, the filter size is in the file name, a file in use
+        is never resized
+        """
+        if self._map is not None:
+            return
+        descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(descriptor, "r+b")
+        length = HEADER_SIZE + 2 * self.size
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            if os.fstat(descriptor).st_size == 0:
+                # new file, empty until rebuilt
+                self._file.truncate(length)
+                self._file.write(HEADER.pack(MAGIC, 0, self.hashes, self.size, 0.0))
+                self._file.flush()
+            else:
+                magic, _, hashes, size, _ = HEADER.unpack(
+                    self._file.read(HEADER.size).ljust(HEADER.size, b"\0")
+                )
+                if (magic, hashes, size) != (MAGIC, self.hashes, self.size) or (
+                    os.fstat(descriptor).st_size != length
+                ):
+                    raise ValueError(f"{self.path} is not an email filter of this size")
+            self._map = mmap.mmap(self._file.fileno(), length)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    @property
+    def active(self) -> int:
+        return self._map[ACTIVE_OFFSET]
+
+    @property
+    def rebuilt_at(self) -> float:
+        return struct.unpack_from("<d", self._map, REBUILT_AT_OFFSET)[0]
+
+    def positions(self, email: str) -> List[int]:
+        digest = hashlib.blake2b(email.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def _offset(self, buffer: int) -> int:
+        return HEADER_SIZE + buffer * self.size
+
+    def add(self, email: str) -> None:
+        if self._map is None:
+            return
+        for position in self.positions(email):
+            self._map[self._offset(0) + position] = 1
+            self._map[self._offset(1) + position] = 1
+
+    def might_contain(self, email: str) -> bool:
+        """
+        False if the email was not registered when the filter was filled
+        """
+        if not self.enabled or self._map is None or not self.rebuilt_at:
+            return True
+        offset = self._offset(self.active)
+        for position in self.positions(email):
+            if not self._map[offset + position]:
+                self.short_circuits += 1
+                return False
+        return True
+
+    def _fill(self, buffer: int, emails: Iterable[str]) -> None:
+        offset = self._offset(buffer)
+        for email in emails:
+            for position in self.positions(email):
+                self._map[offset + position] = 1
+
+    async def rebuild(self, database: Database, batch_size: int = 1000) -> bool:
+        """
+        Refill the inactive buffer from users and switch to it
+        Only one worker rebuilds at a time, the others return False.
+        """
+        self.open()
+        lock = open(self.path + ".lock", "wb")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        try:
+            start = time.perf_counter()
+            buffer = 1 - self.active
+            offset = self._offset(buffer)
+            self._map[offset : offset + self.size] = bytes(self.size)
+            emails: List[str] = []
+            count = 0
+            async for row in database.iterate("SELECT email FROM users"):
+                emails.append(row.email)
+                if len(emails) >= batch_size:
+                    self._fill(buffer, emails)
+                    count += len(emails)
+                    emails.clear()
+            self._fill(buffer, emails)
+            count += len(emails)
+            self._map[ACTIVE_OFFSET] = buffer
+            struct.pack_into("<d", self._map, REBUILT_AT_OFFSET, time.time())
+            self.rebuilds += 1
+            logging.info(
+                "Email filter rebuilt | emails: %s, %.1f ms",
+                count,
+                (time.perf_counter() - start) * 1000,
+            )
+            return True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    async def _run(self, database: Database) -> None:
+        age = math.inf
+        while True:
+            if age >= self.rebuild_interval:
+                try:
+                    await self.rebuild(database)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("Email filter rebuild failed")
+                age = 0
+            if self.rebuild_interval <= 0:
+                return
+            # spread the checks of gunicorn workers
+            await asyncio.sleep(
+                self.rebuild_interval
+                - age
+                + random.uniform(0, self.rebuild_interval / 10)
+            )
+            # another worker may have rebuilt meanwhile
+            age = time.time() - self.rebuilt_at
+
+    def start(self, database: Database) -> None:
+        if not self.enabled:
+            return
+        self.open()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(database))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.close()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "hashes": self.hashes,
+            "rebuilds": self.rebuilds,
+            "rebuilt_at": self.rebuilt_at if self._map is not None else 0.0,
+            "short_circuits": self.short_circuits,
+        }
+
+
+email_filter: EmailFilter = EmailFilter(
+    settings.email_filter_path,
+    settings.email_filter_capacity,
+    settings.email_filter_error_rate,
+    settings.email_filter_rebuild_interval,
+    settings.email_filter_enabled,
+)
@@ -1,28 +1,256 @@
-import smtplib
-from typing import Type
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Deque, List, Optional
 
 from email.message import EmailMessage
-from settings import Settings
+from fastapi import HTTPException, status
 
+from metrics import EMAILS, SMTP_SEND_DURATION
+from settings import Settings, get_settings
 
-settings: Settings = Settings()
+
+if TYPE_CHECKING:
+    import smtplib
+
+
+settings: Settings = get_settings()
 
 
 SENDER: str = "ivand200@gmail.com"
+SMTP_HOST: str = "smtp.gmail.com"
+SMTP_PORT: int = 587
 
 
-def email_service(content: str, client_email: str) -> dict:
-    """
-    Send email via gmail
-    """
+def build_message(content: str, client_email: str) -> EmailMessage:
     msg = EmailMessage()
     msg.set_content(content)
     msg["Subject"] = "Ivan"
     msg["From"] = SENDER
     msg["To"] = client_email
+    return msg
+
+
+class SMTPTransport:
+    """
+    Keep one authenticated SMTP session and reuse it between batches
+    smtplib (and ssl) is imported on the first send, LocalTransport
+    workers never load it
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str) -> None:
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self._session: Optional["smtplib.SMTP"] = None
+
+    def _connect(self) -> "smtplib.SMTP":
+        import smtplib  # pylint: disable=import-outside-toplevel
 
-    with smtplib.SMTP("smtp.gmail.com", 587) as session:
+        session = smtplib.SMTP(self.host, self.port, timeout=30)
         session.starttls()
-        session.login(SENDER, settings.email_code)
-        session.send_message(msg)
-    return {"email": client_email, "status": "sended"}
+        session.login(self.user, self.password)
+        return session
+
+    def send_batch(self, messages: List[EmailMessage]) -> None:
+        """
+        Send messages in order, sent messages are removed from the list
+        """
+        import smtplib  # pylint: disable=import-outside-toplevel
+
+        while messages:
+            if self._session is None:
+                self._session = self._connect()
+            try:
+                self._session.send_message(messages[0])
+            except smtplib.SMTPServerDisconnected:
+                # idle session was dropped by the server, reconnect once
+                self._session = self._connect()
+                self._session.send_message(messages[0])
+            messages.pop(0)
+
+    def close(self) -> None:
+        if self._session is not None:
+            try:
+                self._session.quit()
+            except OSError:
+                pass
+            self._session = None
+
+
+class LocalTransport:
+    """
+    Keep messages in memory instead of sending, for tests and local development
+    """
+
+    def __init__(self, max_size: int = 1000) -> None:
+        self.sent: Deque[EmailMessage] = deque(maxlen=max_size)
+
+    def send_batch(self, messages: List[EmailMessage]) -> None:
+        while messages:
+            msg = messages.pop(0)
+            logging.info(
+                "Local email | to: %s, content: %s", msg["To"], msg.get_content().strip()
+            )
+            self.sent.append(msg)
+
+    def close(self) -> None:
+        pass
+
+
+class EmailOutbox:
+    """
+    Handlers enqueue emails, a background worker sends them in batches
+    with retries and exponential backoff
+    """
+
+    def __init__(
+        self,
+        transport: Any,
+        batch_size: int,
+        max_retries: int,
+        retry_backoff: float,
+        queue_size: int,
+    ) -> None:
+        self.transport = transport
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue_size = queue_size
+        # created in start(), on python 3.8 a queue binds to the loop current
+        # at creation and the app serves on another one
+        self.queue: Optional["asyncio.Queue[Optional[EmailMessage]]"] = None
+        self.sent = 0
+        self.failed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, msg: EmailMessage) -> None:
+        try:
+            if self.queue is None:
+                raise asyncio.QueueFull
+            self.queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            logging.error("Email outbox is full | to: %s", msg["To"])
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Email service is busy, try again later.",
+            )
+
+    async def start(self) -> None:
+        if self._task is None:
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._worker(self.queue))
+
+    async def stop(self) -> None:
+        """
+        Flush queued emails and close the transport
+        """
+        if self._task is not None and self.queue is not None:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.transport.close)
+
+    async def _worker(self, queue: "asyncio.Queue[Optional[EmailMessage]]") -> None:
+        while True:
+            msg = await queue.get()
+            if msg is None:
+                return
+            batch = [msg]
+            while len(batch) < self.batch_size and not queue.empty():
+                msg = queue.get_nowait()
+                if msg is None:
+                    await self._send(batch)
+                    return
+                batch.append(msg)
+            await self._send(batch)
+
+    async def _send(self, batch: List[EmailMessage]) -> None:
+        """
+        Send the batch, transient errors are retried with backoff,
+        a message refused permanently is dropped alone
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while batch:
+            size = len(batch)
+            start = time.perf_counter()
+            try:
+                await loop.run_in_executor(None, self.transport.send_batch, batch)
+            # SMTPException is an OSError
+            except OSError as error:
+                self._count_sent(size - len(batch))
+                if is_permanent(error):
+                    # the failed message is first in the batch, the rest is sent on
+                    self._count_failed([batch.pop(0)], error)
+                    continue
+                if attempt == self.max_retries:
+                    self._count_failed(batch, error)
+                    return
+                delay = self.retry_backoff * 2**attempt
+                attempt += 1
+                logging.warning(
+                    "Email send failed, retry in %s s | error: %s", delay, error
+                )
+                await loop.run_in_executor(None, self.transport.close)
+                await asyncio.sleep(delay)
+            else:
+                self._count_sent(size)
+                return
+            finally:
+                SMTP_SEND_DURATION.observe(time.perf_counter() - start)
+
+    def _count_sent(self, count: int) -> None:
+        self.sent += count
+        EMAILS.labels("sent").inc(count)
+
+    def _count_failed(self, messages: List[EmailMessage], error: OSError) -> None:
+        self.failed += len(messages)
+        EMAILS.labels("failed").inc(len(messages))
+        logging.error(
+            "Email send failed | to: %s, error: %s",
+            ", ".join(str(msg["To"]) for msg in messages),
+            error,
+        )
+
+
+def is_permanent(error: OSError) -> bool:
+    """
+    5xx replies and refused recipients fail again on retry, unlike dropped
+    connections and 4xx replies. Authentication errors are about the
+    session, not the message.
+    """
+    import smtplib  # pylint: disable=import-outside-toplevel
+
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return (
+        isinstance(error, smtplib.SMTPResponseException)
+        and not isinstance(error, smtplib.SMTPAuthenticationError)
+        and error.smtp_code >= 500
+    )
+
+
+def get_transport() -> Any:
+    if settings.email_transport == "local":
+        return LocalTransport()
+    return SMTPTransport(SMTP_HOST, SMTP_PORT, SENDER, settings.email_code)
+
+
+email_outbox: EmailOutbox = EmailOutbox(
+    get_transport(),
+    batch_size=settings.email_batch_size,
+    max_retries=settings.email_max_retries,
+    retry_backoff=settings.email_retry_backoff,
+    queue_size=settings.email_queue_size,
+)
+
+
+def email_service(content: str, client_email: str) -> dict:
+    """
+    Queue email for the background sender
+    """
+    email_outbox.enqueue(build_message(content, client_email))
+    return {"email": client_email, "status": "queued"}
@@ -0,0 +1,170 @@
+"""
+Export users as NDJSON or CSV in id order, batch by batch in constant memory
+    python exporter.py --fields id,email,verified --format csv --gzip -o users.csv.gz
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import sys
+import zlib
+from typing import AsyncIterator, List, Optional, Tuple
+
+from databases import Database
+
+from db import get_database
+from models.users import USER_PUBLIC_FIELDS
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+EXPORT_FORMATS: tuple = ("ndjson", "csv")
+MEDIA_TYPES: dict = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_query(
+    columns: List[str],
+    verified: Optional[bool] = None,
+    is_admin: Optional[bool] = None,
+    min_id: Optional[int] = None,
+    max_id: Optional[int] = None,
+) -> Tuple[str, dict]:
+    """
+    Keyset page query, filters are pushed down to WHERE
+    values miss after_id and limit, they change every page
+    """
+    conditions = ["id > :after_id"]
+    values: dict = {}
+    if verified is not None:
+        conditions.append("verified = :verified")
+        values["verified"] = int(verified)
+    if is_admin is not None:
+        conditions.append("is_admin = :is_admin")
+        values["is_admin"] = int(is_admin)
+    if min_id is not None:
+        conditions.append("id >= :min_id")
+        values["min_id"] = min_id
+    if max_id is not None:
+        conditions.append("id <= :max_id")
+        values["max_id"] = max_id
+    query = f"""
+        SELECT {", ".join(columns)} FROM users
+        WHERE {" AND ".join(conditions)}
+        ORDER BY id LIMIT :limit
+        """
+    return query, values
+
+
+async def export_batches(
+    database: Database, columns: List[str], batch_size: int, **filters: Optional[int]
+) -> AsyncIterator[List[dict]]:
+    """
+    Pages of batch_size rows, a short query per page holds no connection
+    between pages, unlike iterate over the whole table
+    """
+    if "id" not in columns:
+        columns = ["id", *columns]
+    query, values = export_query(columns, **filters)
+    after_id = 0
+    while True:
+        rows = await database.fetch_all(
+            query=query, values=dict(values, after_id=after_id, limit=batch_size)
+        )
+        if not rows:
+            return
+        batch = [dict(row._mapping) for row in rows]
+        yield batch
+        if len(rows) < batch_size:
+            return
+        after_id = batch[-1]["id"]
+
+
+def encode_batch(batch: List[dict], columns: List[str], format: str) -> str:
+    if format == "ndjson":
+        return "".join(
+            json.dumps({column: row[column] for column in columns}) + "\n"
+            for row in batch
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows([row[column] for column in columns] for row in batch)
+    return buffer.getvalue()
+
+
+async def export_users(
+    database: Database,
+    columns: List[str],
+    format: str,
+    compress: bool = False,
+    batch_size: int = settings.export_batch_size,
+    **filters: Optional[int],
+) -> AsyncIterator[bytes]:
+    """
+    Encoded chunks of the export, one per batch, gzip stream if compress
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {format}")
+    # gzip container, readable by gunzip and pandas
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    if format == "csv":
+        yield encode(",".join(columns) + "\n")
+    async for batch in export_batches(database, columns, batch_size, **filters):
+        chunk = encode(encode_batch(batch, columns, format))
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
+
+
+def parse_bool(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+async def main(args: argparse.Namespace) -> None:
+    database = get_database()
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    await database.connect()
+    try:
+        async for chunk in export_users(
+            database,
+            args.fields,
+            args.format,
+            compress=args.gzip,
+            batch_size=args.batch_size,
+            verified=args.verified,
+            is_admin=args.is_admin,
+            min_id=args.min_id,
+            max_id=args.max_id,
+        ):
+            output.write(chunk)
+    finally:
+        await database.disconnect()
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fields", default="id,username,email")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--verified", type=parse_bool)
+    parser.add_argument("--is-admin", type=parse_bool)
+    parser.add_argument("--min-id", type=int)
+    parser.add_argument("--max-id", type=int)
+    parser.add_argument("--batch-size", type=int, default=settings.export_batch_size)
+    parser.add_argument("-o", "--output", help="file, stdout by default")
+    args = parser.parse_args()
+    args.fields = [field.strip() for field in args.fields.split(",") if field.strip()]
+    unknown = set(args.fields) - set(USER_PUBLIC_FIELDS)
+    if unknown or not args.fields:
+        parser.error(f"Available fields: {', '.join(USER_PUBLIC_FIELDS)}")
+    asyncio.run(main(args))
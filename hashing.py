@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from metrics import PASSWORD_HASH_DURATION
+from password import (
+    configure,
+    password_config,
+    password_hash,
+    verify_and_update,
+    verify_password,
+)
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+# seconds between checks for room in a full queue, run(wait=True)
+QUEUE_POLL_INTERVAL: float = 0.01
+
+
+class HashingExecutor:
+    """
+    Run password hashing off the event loop in a dedicated pool
+    hash_pool_size > 0 - process pool, 0 - thread pool (bcrypt releases the GIL)
+    Pool processes get the password_config of the parent at start.
+    """
+
+    def __init__(self, pool_size: int, queue_size: int) -> None:
+        self.pool_size = pool_size
+        self.queue_size = queue_size
+        self.pending = 0
+        self.calls = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._executor: Optional[Executor] = None
+
+    def start(self) -> None:
+        if self._executor is not None:
+            return
+        if self.pool_size > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.pool_size,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=configure,
+                initargs=(dict(password_config),),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(thread_name_prefix="hashing")
+        logging.info("Hashing executor started | pool_size: %s", self.pool_size)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def run(self, func: Callable, *args: Any, wait: bool = False) -> Any:
+        """
+        Submit func to the pool, reject with 503 if the queue is full
+        wait - wait for room in the queue instead, for bulk work like imports
+        """
+        while self.pending >= self.queue_size:
+            if not wait:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Server is busy, try again later.",
+                )
+            await asyncio.sleep(QUEUE_POLL_INTERVAL)
+        self.start()
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+            elapsed = time.perf_counter() - start
+            self.calls += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            PASSWORD_HASH_DURATION.labels(func.__name__).observe(elapsed)
+            logging.debug("Hashing | %s: %.1f ms", func.__name__, elapsed * 1000)
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": self.pool_size,
+            "queue_size": self.queue_size,
+            "pending": self.pending,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "avg_ms": self.total_seconds / self.calls * 1000 if self.calls else 0.0,
+            "max_ms": self.max_seconds * 1000,
+        }
+
+
+hashing_executor: HashingExecutor = HashingExecutor(
+    settings.hash_pool_size, settings.hash_queue_size
+)
+
+
+async def async_password_hash(password: str) -> str:
+    return await hashing_executor.run(password_hash, password)
+
+
+async def async_verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await hashing_executor.run(verify_password, plain_password, hashed_password)
+
+
+async def async_verify_and_update(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    return await hashing_executor.run(verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,339 @@
+"""
+Bulk user import from CSV (with header) or JSONL, one user per line
+Fields: email, username, password or password_hash, verified, is_admin
+    python importer.py users.csv --checkpoint users.checkpoint --errors errors.jsonl
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import sqlalchemy
+from databases import Database
+from pydantic import ValidationError
+
+from db import INTEGRITY_ERRORS, get_database
+from email_filter import email_filter
+from hashing import HashingExecutor
+from models.users import ImportUser
+from outbox import add_events
+from password import configure_from_settings, password_hash, pwd_context
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+IMPORT_FORMATS: tuple = ("csv", "jsonl")
+INSERT_COLUMNS: tuple = (
+    "username",
+    "email",
+    "password",
+    "verified",
+    "verification_code",
+    "is_admin",
+)
+# rows per multi-row INSERT, 6 binds each stay under SQLite's 999 variables
+INSERT_BATCH_ROWS: int = 150
+
+
+class RecordParser:
+    """
+    Line -> dict, the first CSV line is the header
+    """
+
+    def __init__(self, format: str) -> None:
+        if format not in IMPORT_FORMATS:
+            raise ValueError(f"Unknown import format: {format}")
+        self.format = format
+        self.header: Optional[List[str]] = None
+
+    def parse(self, line: str) -> Optional[dict]:
+        """
+        None for the CSV header and blank lines
+        """
+        if not line.strip():
+            return None
+        if self.format == "jsonl":
+            return json.loads(line)
+        row = next(csv.reader([line]))
+        if self.header is None:
+            self.header = [column.strip() for column in row]
+            return None
+        return {
+            column: value
+            for column, value in zip(self.header, row)
+            if value != "" and column
+        }
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Split a byte stream (request body) into lines
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode()
+    if buffer:
+        yield buffer.decode()
+
+
+async def aiter_file(path: str) -> AsyncIterator[str]:
+    with open(path, encoding="utf-8", newline="") as lines:
+        for line in lines:
+            yield line
+
+
+class UserImporter:
+    """
+    Validate, hash in parallel and insert users in chunks
+    Every chunk is one transaction followed by a checkpoint (last line),
+    rerun with start_line=checkpoint to resume. Rejected lines are reported
+    with their line number, existing emails are rejected, not updated.
+    Imported users get a "registered" outbox event, like registration.
+    Hashing waits for room in a shared executor instead of failing rows.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        executor: HashingExecutor,
+        chunk_size: int,
+        concurrency: int,
+        on_checkpoint: Optional[Callable[[int], None]] = None,
+        on_error: Optional[Callable[[dict], None]] = None,
+        max_errors_kept: int = 1000,
+    ) -> None:
+        self.database = database
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.on_checkpoint = on_checkpoint
+        self.on_error = on_error
+        self.max_errors_kept = max_errors_kept
+        self.imported = 0
+        self.error_count = 0
+        self.errors: List[dict] = []
+        self.last_line = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def error(self, line: int, email: Optional[str], message: str) -> None:
+        error = {"line": line, "email": email, "error": message}
+        self.error_count += 1
+        if len(self.errors) < self.max_errors_kept:
+            self.errors.append(error)
+        if self.on_error is not None:
+            self.on_error(error)
+
+    async def run(
+        self, lines: AsyncIterator[str], format: str, start_line: int = 0
+    ) -> dict:
+        parser = RecordParser(format)
+        chunk: List[Tuple[int, ImportUser]] = []
+        line_number = 0
+        async for line in lines:
+            line_number += 1
+            try:
+                record = parser.parse(line)
+            except (ValueError, csv.Error) as error:
+                if line_number > start_line:
+                    self.error(line_number, None, f"Can't parse line: {error}")
+                continue
+            if record is None or line_number <= start_line:
+                continue
+            try:
+                chunk.append((line_number, ImportUser(**record)))
+            except (ValidationError, TypeError) as error:
+                email = record.get("email") if isinstance(record, dict) else None
+                self.error(line_number, email, str(error).replace("\n", " "))
+            if len(chunk) >= self.chunk_size:
+                await self.import_chunk(chunk, line_number)
+                chunk = []
+        await self.import_chunk(chunk, line_number)
+        return self.report()
+
+    async def hash_password(self, user: ImportUser) -> str:
+        if user.password_hash is not None:
+            if pwd_context.identify(user.password_hash) is None:
+                raise ValueError("Unknown password_hash scheme")
+            return user.password_hash
+        async with self._semaphore:
+            return await self.executor.run(password_hash, user.password, wait=True)
+
+    async def import_chunk(
+        self, chunk: List[Tuple[int, ImportUser]], last_line: int
+    ) -> None:
+        rows: Dict[str, Tuple[int, ImportUser]] = {}
+        for line, user in chunk:
+            if user.email in rows:
+                self.error(line, user.email, "Duplicate email in the import.")
+            else:
+                rows[user.email] = (line, user)
+        if rows:
+            query = sqlalchemy.text(
+                "SELECT email FROM users WHERE email IN :emails"
+            ).bindparams(sqlalchemy.bindparam("emails", list(rows), expanding=True))
+            for existing in await self.database.fetch_all(query):
+                line, _ = rows.pop(existing.email)
+                self.error(line, existing.email, "Email already exists.")
+        hashes = await asyncio.gather(
+            *(self.hash_password(user) for _, user in rows.values()),
+            return_exceptions=True,
+        )
+        values = []
+        for (line, user), hashed in zip(rows.values(), hashes):
+            if isinstance(hashed, Exception):
+                self.error(line, user.email, str(hashed))
+                continue
+            values.append(
+                {
+                    "username": user.username,
+                    "email": user.email,
+                    "password": hashed,
+                    "verified": int(user.verified),
+                    "verification_code": random.randint(1000, 9999),
+                    "is_admin": int(user.is_admin),
+                }
+            )
+        if values:
+            async with self.database.transaction():
+                inserted = await self.insert(values)
+                await add_events(
+                    self.database,
+                    [
+                        {"registered": user_id, "email": email}
+                        for email, user_id in inserted.items()
+                    ],
+                )
+            for value in values:
+                if value["email"] in inserted:
+                    email_filter.add(value["email"])
+                else:
+                    # registered after the existence check
+                    line, _ = rows[value["email"]]
+                    self.error(line, value["email"], "Email already exists.")
+            self.imported += len(inserted)
+        self.last_line = last_line
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(last_line)
+
+    async def insert(self, values: List[dict]) -> Dict[str, int]:
+        """
+        COPY on Postgres, multi-row INSERT elsewhere and when COPY hits a
+        concurrent registration of the same email, returns inserted email: id
+        """
+        if self.database.url.dialect == "postgresql":
+            try:
+                async with self.database.transaction():
+                    connection = self.database.connection().raw_connection
+                    await connection.copy_records_to_table(
+                        "users",
+                        columns=INSERT_COLUMNS,
+                        records=[
+                            tuple(value[column] for column in INSERT_COLUMNS)
+                            for value in values
+                        ],
+                    )
+                    emails = [value["email"] for value in values]
+                    query = sqlalchemy.text(
+                        "SELECT id, email FROM users WHERE email IN :emails"
+                    ).bindparams(sqlalchemy.bindparam("emails", emails, expanding=True))
+                    rows = await self.database.fetch_all(query)
+                return {row.email: row.id for row in rows}
+            except INTEGRITY_ERRORS:
+                pass
+        inserted: Dict[str, int] = {}
+        for start in range(0, len(values), INSERT_BATCH_ROWS):
+            batch = values[start : start + INSERT_BATCH_ROWS]
+            rows = ", ".join(
+                "(" + ", ".join(f":{column}_{i}" for column in INSERT_COLUMNS) + ")"
+                for i in range(len(batch))
+            )
+            query = f"""
+                INSERT INTO users({", ".join(INSERT_COLUMNS)}) VALUES {rows}
+                ON CONFLICT (email) DO NOTHING
+                RETURNING id, email
+                """
+            binds = {
+                f"{column}_{i}": value[column]
+                for i, value in enumerate(batch)
+                for column in INSERT_COLUMNS
+            }
+            for row in await self.database.fetch_all(query=query, values=binds):
+                inserted[row.email] = row.id
+        return inserted
+
+    def report(self) -> dict:
+        return {
+            "imported": self.imported,
+            "errors": self.error_count,
+            "last_line": self.last_line,
+            "first_errors": self.errors,
+        }
+
+
+def read_checkpoint(path: Optional[str]) -> int:
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path) as checkpoint:
+        return int(checkpoint.read().strip() or 0)
+
+
+def write_checkpoint(path: str, line: int) -> None:
+    with open(path + ".tmp", "w") as checkpoint:
+        checkpoint.write(str(line))
+    os.replace(path + ".tmp", path)
+
+
+async def main(args: argparse.Namespace) -> dict:
+    configure_from_settings()
+    database = get_database()
+    executor = HashingExecutor(args.workers, queue_size=args.workers * 4)
+    if email_filter.enabled:
+        email_filter.open()
+    errors: Any = open(args.errors, "a") if args.errors else None
+    await database.connect()
+    importer = UserImporter(
+        database,
+        executor,
+        chunk_size=args.chunk_size,
+        concurrency=args.workers * 2,
+        on_checkpoint=(
+            (lambda line: write_checkpoint(args.checkpoint, line))
+            if args.checkpoint
+            else None
+        ),
+        on_error=(
+            (lambda error: errors.write(json.dumps(error) + "\n")) if errors else None
+        ),
+        max_errors_kept=0 if errors else 1000,
+    )
+    try:
+        return await importer.run(
+            aiter_file(args.file), args.format, read_checkpoint(args.checkpoint)
+        )
+    finally:
+        await database.disconnect()
+        executor.shutdown()
+        email_filter.close()
+        if errors:
+            errors.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=IMPORT_FORMATS)
+    parser.add_argument("--chunk-size", type=int, default=settings.import_chunk_size)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--checkpoint", help="resume from and save the last line here")
+    parser.add_argument("--errors", help="append rejected lines to this JSONL file")
+    args = parser.parse_args()
+    if args.format is None:
+        args.format = "csv" if args.file.endswith(".csv") else "jsonl"
+    print(json.dumps(asyncio.run(main(args)), indent=2))
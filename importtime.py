@@ -0,0 +1,80 @@
+"""
+Cold import time of the app, what a new gunicorn worker pays before serving
+
+Every run imports the module in a fresh interpreter with -X importtime:
+    TEST=test python importtime.py --runs 10 --output importtime.json
+Track total_ms between releases, top lists the slowest modules (cumulative).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    -X importtime lines -> (module, self us, cumulative us)
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def measure(module: str) -> List[Tuple[str, int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=os.environ,
+    )
+    return parse_importtime(result.stderr)
+
+
+def benchmark(module: str, runs: int, top: int) -> dict:
+    totals: List[float] = []
+    cumulative: Dict[str, List[int]] = {}
+    for _ in range(runs):
+        modules = measure(module)
+        for name, _, cumulative_us in modules:
+            cumulative.setdefault(name, []).append(cumulative_us)
+        totals.append(cumulative[module][-1] / 1000)
+    slowest = sorted(
+        (
+            (name, statistics.median(values) / 1000)
+            for name, values in cumulative.items()
+            if name != module and "." not in name
+        ),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    return {
+        "module": module,
+        "runs": runs,
+        "total_ms": statistics.median(totals),
+        "min_ms": min(totals),
+        "max_ms": max(totals),
+        "top": [{"module": name, "ms": ms} for name, ms in slowest[:top]],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="write JSON report to the file")
+    args = parser.parse_args()
+    report = benchmark(args.module, args.runs, args.top)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
@@ -0,0 +1,268 @@
+"""
+Load generator for the auth endpoints
+
+In-process over ASGI (default) or over real sockets with --url:
+    TEST=test python loadtest.py --mix signup:1,introspection:9 --concurrency 50
+    python loadtest.py --url http://127.0.0.1:8000 --duration 30 --output run.json
+Verification codes are read from the configured database, so --url mode
+has to point at a server that uses the same database.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+SCENARIOS: tuple = ("signup", "introspection")
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    index = max(math.ceil(percent / 100 * len(values)) - 1, 0)
+    return values[index]
+
+
+class Recorder:
+    """
+    Latencies and errors per endpoint
+    """
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def request(
+        self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs: Any
+    ) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        if response is None or response.status_code >= 400:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        return response
+
+    @staticmethod
+    def summary(latencies: List[float], errors: int, duration: float) -> dict:
+        latencies = sorted(latencies)
+        return {
+            "requests": len(latencies),
+            "rps": len(latencies) / duration if duration else 0.0,
+            "errors": errors,
+            "error_rate": errors / len(latencies) if latencies else 0.0,
+            "latency_ms": {
+                "p50": percentile(latencies, 50) * 1000,
+                "p95": percentile(latencies, 95) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "max": latencies[-1] * 1000 if latencies else 0.0,
+            },
+        }
+
+    def report(self, duration: float) -> dict:
+        all_latencies = [
+            value for values in self.latencies.values() for value in values
+        ]
+        report = self.summary(all_latencies, sum(self.errors.values()), duration)
+        report["endpoints"] = {
+            name: self.summary(values, self.errors.get(name, 0), duration)
+            for name, values in sorted(self.latencies.items())
+        }
+        return report
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, database: Any) -> None:
+        self.client = client
+        self.database = database
+        self.recorder = Recorder()
+        self.tokens: List[str] = []
+        self.emails: List[str] = []
+
+    async def signup(self) -> None:
+        """
+        register -> confirm -> login -> check-token
+        """
+        email = f"load_{uuid.uuid4().hex[:12]}@loadtest.com"
+        password = "load_P@55"
+        self.emails.append(email)
+        request = self.recorder.request
+        registered = await request(
+            self.client,
+            "registration",
+            "POST",
+            "/users/registration",
+            json={"email": email, "password": password, "username": "load"},
+        )
+        if registered is None:
+            return
+        code = await self.database.fetch_val(
+            query="SELECT verification_code FROM users WHERE email = :email",
+            values={"email": email},
+        )
+        confirmed = await request(
+            self.client,
+            "confirm",
+            "POST",
+            "/users/confirm",
+            json={"email": email, "code": code},
+        )
+        if confirmed is None:
+            return
+        login = await request(
+            self.client,
+            "login",
+            "POST",
+            "/users/login",
+            json={"email": email, "password": password},
+        )
+        if login is None:
+            return
+        token = login.json()["access_token"]
+        self.tokens.append(token)
+        await request(
+            self.client,
+            "check-token",
+            "POST",
+            "/users/check-token",
+            headers={"Authorization": "Bearer " + token},
+        )
+
+    async def introspection(self) -> None:
+        if not self.tokens:
+            await self.signup()
+            return
+        await self.recorder.request(
+            self.client,
+            "check-token",
+            "POST",
+            "/users/check-token",
+            headers={"Authorization": "Bearer " + random.choice(self.tokens)},
+        )
+
+    async def worker(self, mix: Dict[str, int], deadline: float) -> None:
+        names, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            scenario = random.choices(names, weights)[0]
+            await getattr(self, scenario)()
+
+    async def run(
+        self, mix: Dict[str, int], concurrency: int, duration: float, warmup_users: int
+    ) -> dict:
+        # introspection needs tokens before the measured run
+        await asyncio.gather(*(self.signup() for _ in range(warmup_users)))
+        self.recorder = Recorder()
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(self.worker(mix, start + duration) for _ in range(concurrency))
+        )
+        return self.recorder.report(time.perf_counter() - start)
+
+    async def cleanup(self) -> None:
+        for email in self.emails:
+            user_id = await self.database.fetch_val(
+                query="SELECT id FROM users WHERE email = :email",
+                values={"email": email},
+            )
+            if user_id is None:
+                continue
+            await self.database.execute(
+                query="DELETE FROM access_tokens WHERE user_id = :id",
+                values={"id": user_id},
+            )
+            await self.database.execute(
+                query="DELETE FROM users WHERE id = :id", values={"id": user_id}
+            )
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    result = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition(":")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario: {name}")
+        result[name] = int(weight or 1)
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> dict:
+    # in-process runs send no emails and do not throttle logins
+    os.environ.setdefault("EMAIL_TRANSPORT", "local")
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    from main import app  # pylint: disable=import-outside-toplevel
+    from db import get_database  # pylint: disable=import-outside-toplevel
+
+    database = get_database()
+    limits = httpx.Limits(max_connections=args.concurrency)
+    if args.url:
+        await database.connect()
+        client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30)
+    else:
+        await app.router.startup()
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://loadtest",
+            timeout=30,
+        )
+    load_test = LoadTest(client, database)
+    try:
+        report = await load_test.run(
+            args.mix, args.concurrency, args.duration, args.warmup_users
+        )
+    finally:
+        await client.aclose()
+        await load_test.cleanup()
+        if args.url:
+            await database.disconnect()
+        else:
+            await app.router.shutdown()
+    report.update(
+        {
+            "commit": git_commit(),
+            "transport": "socket" if args.url else "asgi",
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+        }
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="server url, in-process ASGI if omitted")
+    parser.add_argument("--mix", type=parse_mix, default="signup:1,introspection:9")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup-users", type=int, default=10)
+    parser.add_argument("--output", help="write JSON report to the file")
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(output)
+    print(output)
@@ -1,12 +1,29 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Response
 from starlette.middleware.cors import CORSMiddleware
 import uvicorn
 
-from routers.users import users_router
-from db import get_database, metadata, sqlalchemy_engine, database
+from routers.users import get_admin_user, users_router
+from db import create_schema, get_database, get_db_router
+from hashing import hashing_executor
+from password import configure_from_settings
+from email_service import email_outbox
+from email_filter import email_filter
+from reaper import token_reaper
+from sessions import session_extender
+from metrics import (
+    METRICS_CONTENT_TYPE,
+    PrometheusMiddleware,
+    render_metrics,
+)
+from query_profiler import query_profiler
+from responses import response_class
+from settings import Settings, get_settings
+
 
+settings: Settings = get_settings()
 
-app = FastAPI()
+
+app = FastAPI(default_response_class=response_class)
 
 
 app.add_middleware(
@@ -16,22 +33,58 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(PrometheusMiddleware)
 
 
 @app.on_event("startup")
 async def startup():
     # await database.connect()
-    await get_database().connect()
+    if settings.db_create_schema:
+        create_schema()
+    await get_db_router().connect()
+    configure_from_settings()
+    hashing_executor.start()
+    await email_outbox.start()
+    token_reaper.start(get_database())
+    session_extender.start(get_database())
+    email_filter.start(get_database())
 
 
 @app.on_event("shutdown")
 async def shutdown():
     # await database.disconnect()
-    await get_database().disconnect()
+    await token_reaper.stop()
+    await session_extender.stop(get_database())
+    await email_filter.stop()
+    await get_db_router().disconnect()
+    hashing_executor.shutdown()
+    await email_outbox.stop()
 
 
 app.include_router(users_router, prefix="/users", tags=["users"])
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """
+    Prometheus metrics of all workers
+    """
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+if settings.query_profiler:
+
+    @app.get(
+        "/debug/queries",
+        include_in_schema=False,
+        dependencies=[Depends(get_admin_user)],
+    )
+    async def debug_queries(limit: int = 0) -> list:
+        """
+        Most expensive query fingerprints of this worker, admin only
+        """
+        return query_profiler.top(limit)
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -0,0 +1,150 @@
+"""
+Prometheus metrics
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py),
+every worker writes its samples there and /metrics aggregates them.
+"""
+import os
+import time
+from typing import Any, Dict, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+HTTP_REQUEST_DURATION: Histogram = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency",
+    ["method", "route", "status"],
+)
+DB_QUERY_DURATION: Histogram = Histogram(
+    "db_query_duration_seconds",
+    "Database query latency",
+    ["method", "statement"],
+)
+DB_QUERY_ERRORS: Counter = Counter(
+    "db_query_errors_total", "Failed database queries", ["method", "statement"]
+)
+DB_POOL_IN_USE: Gauge = Gauge(
+    "db_pool_connections_in_use",
+    "Database connections running a query",
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAITING: Gauge = Gauge(
+    "db_pool_waiting",
+    "Queries waiting for a database connection",
+    multiprocess_mode="livesum",
+)
+DB_POOL_ACQUIRE_DURATION: Histogram = Histogram(
+    "db_pool_acquire_duration_seconds", "Time spent waiting for a database connection"
+)
+DB_POOL_TIMEOUTS: Counter = Counter(
+    "db_pool_acquire_timeouts_total", "Database connection acquire timeouts"
+)
+PASSWORD_HASH_DURATION: Histogram = Histogram(
+    "password_hash_duration_seconds",
+    "Password hashing latency including executor queueing",
+    ["operation"],
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0),
+)
+SMTP_SEND_DURATION: Histogram = Histogram(
+    "smtp_send_duration_seconds", "SMTP batch send latency"
+)
+EMAILS: Counter = Counter("emails_total", "Emails by send result", ["result"])
+RABBIT_PUBLISH_DURATION: Histogram = Histogram(
+    "rabbit_publish_duration_seconds", "RabbitMQ batch publish latency"
+)
+RABBIT_MESSAGES: Counter = Counter(
+    "rabbit_messages_total", "RabbitMQ messages by publish result", ["result"]
+)
+TOKEN_CACHE_REQUESTS: Counter = Counter(
+    "token_cache_requests_total", "Token cache lookups", ["result"]
+)
+TOKENS_REAPED: Counter = Counter(
+    "access_tokens_reaped_total", "Expired access tokens deleted by the reaper"
+)
+SESSIONS_EXTENDED: Counter = Counter(
+    "access_tokens_extended_total", "Access tokens extended by sliding sessions"
+)
+
+STATEMENTS: tuple = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+
+def statement_type(query: Any) -> str:
+    words = str(query).split(None, 1)
+    verb = words[0].upper() if words else ""
+    return verb if verb in STATEMENTS else "OTHER"
+
+
+def observe_query(
+    method: str, query: Any, values: Optional[dict], seconds: float, error: bool
+) -> None:
+    """
+    InstrumentedDatabase observer
+    """
+    statement = statement_type(query)
+    DB_QUERY_DURATION.labels(method, statement).observe(seconds)
+    if error:
+        DB_QUERY_ERRORS.labels(method, statement).inc()
+
+
+class PrometheusMiddleware:
+    """
+    Record latency per route template, method and status code
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._routes: Dict[Any, str] = {}
+
+    def route_path(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self._routes:
+            for route in scope["router"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    self._routes[endpoint] = route.path
+                    break
+            else:
+                return "unmatched"
+        return self._routes[endpoint]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], self.route_path(scope), str(status_code)
+            ).observe(time.perf_counter() - start)
+
+
+def render_metrics() -> bytes:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+METRICS_CONTENT_TYPE: str = CONTENT_TYPE_LATEST
@@ -0,0 +1,14 @@
+from typing import Any
+
+import sqlalchemy
+
+from db import metadata
+
+
+outbox: Any = sqlalchemy.Table(
+    "outbox",
+    metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True, autoincrement=True),
+    sqlalchemy.Column("payload", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("created_at", sqlalchemy.DateTime(), nullable=False),
+)
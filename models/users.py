@@ -1,16 +1,22 @@
-from typing import Any, Type
+from typing import Any, List, Optional, Type
 from datetime import datetime, timedelta
-from pydantic import BaseModel, Field, EmailStr  # type: ignore
+from pydantic import BaseModel, Field, EmailStr, root_validator  # type: ignore
 
 import sqlalchemy
 from sqlalchemy.sql.schema import MetaData
 
 from db import metadata
 from password import generate_token
+from settings import Settings, get_settings
 
 
-def get_expiration_date(duration_seconds: int = 86400) -> datetime:
-    """Calculate expiration time for token"""
+settings: Settings = get_settings()
+
+
+def get_expiration_date(duration_seconds: Optional[int] = None) -> datetime:
+    """Calculate expiration time for token, settings.token_lifetime by default"""
+    if duration_seconds is None:
+        duration_seconds = settings.token_lifetime
     return datetime.now() + timedelta(seconds=duration_seconds)
 
 
@@ -63,14 +69,60 @@ class AccessToken(BaseModel):
         orm_mode: bool = True
 
 
+class TokenUser(BaseModel):
+    id: int
+    email: str
+    username: str
+    access_token: str
+    expiration_date: datetime
+
+    class Config:
+        orm_mode: bool = True
+
+
+class TokenBatch(BaseModel):
+    tokens: List[str]
+
+
+class TokenIntrospection(BaseModel):
+    token: str
+    active: bool
+    id: Optional[int] = None
+    email: Optional[str] = None
+    username: Optional[str] = None
+    expiration_date: Optional[datetime] = None
+
+
 class EmailConfirm(BaseModel):
     email: str
     code: int
 
 
+class ImportUser(BaseModel):
+    """
+    One line of a bulk import, password or an existing password_hash
+    """
+
+    email: EmailStr
+    username: str
+    password: Optional[str] = None
+    password_hash: Optional[str] = None
+    verified: bool = False
+    is_admin: bool = False
+
+    @root_validator(skip_on_failure=True)
+    def password_or_hash(cls, values: dict) -> dict:
+        if not values.get("password") and not values.get("password_hash"):
+            raise ValueError("password or password_hash is required")
+        return values
+
+
 # metadata = sqlalchemy.MetaData()
 
 
+USER_PUBLIC_FIELDS: tuple = ("id", "username", "email", "verified", "is_admin")
+
+
 users: Any = sqlalchemy.Table(
     "users",
     metadata,
@@ -83,6 +135,8 @@ users: Any = sqlalchemy.Table(
     sqlalchemy.Column("verified", sqlalchemy.Integer, nullable=False),
     sqlalchemy.Column("verification_code", sqlalchemy.Integer),
     sqlalchemy.Column("is_admin", sqlalchemy.Integer, default=0, nullable=False),
+    # requested by /email-reset, set as email by /email-confirm
+    sqlalchemy.Column("pending_email", sqlalchemy.String),
 )
 
 access_tokens: Any = sqlalchemy.Table(
@@ -92,5 +146,6 @@ access_tokens: Any = sqlalchemy.Table(
     sqlalchemy.Column(
         "user_id", sqlalchemy.ForeignKey("users.id"), nullable=False, unique=True
     ),
-    sqlalchemy.Column("expiration_date", sqlalchemy.DateTime(), nullable=False),
+    # epoch seconds, compared in SQL
+    sqlalchemy.Column("expires_at", sqlalchemy.BigInteger, nullable=False, index=True),
 )
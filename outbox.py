@@ -0,0 +1,111 @@
+"""
+Transactional outbox for user lifecycle events
+Handlers write events with add_event in the same transaction as the change,
+the relay (python outbox.py) publishes them to RabbitMQ in order and deletes
+what was published, the remaining rows are the relay position.
+"""
+import json
+import logging
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, List
+
+import sqlalchemy
+from databases import Database
+
+from db import get_engine
+from models.outbox import outbox
+from settings import Settings, get_settings
+
+
+if TYPE_CHECKING:
+    from send import RabbitPublisher
+
+
+settings: Settings = get_settings()
+
+
+async def add_event(database: Database, message: dict) -> None:
+    """
+    Write event to the outbox, call inside the caller's transaction
+    """
+    query = """INSERT INTO outbox(payload, created_at) VALUES (:payload, :created_at)"""
+    await database.execute(
+        query=query,
+        values={"payload": json.dumps(message), "created_at": datetime.now()},
+    )
+
+
+async def add_events(database: Database, messages: List[dict]) -> None:
+    """
+    Write events to the outbox in order, call inside the caller's transaction
+    """
+    if not messages:
+        return
+    query = """INSERT INTO outbox(payload, created_at) VALUES (:payload, :created_at)"""
+    created_at = datetime.now()
+    await database.execute_many(
+        query=query,
+        values=[
+            {"payload": json.dumps(message), "created_at": created_at}
+            for message in messages
+        ],
+    )
+
+
+def checkpoint(connection: Any, published_ids: list) -> None:
+    """
+    Remove published events, the relay resumes from the oldest remaining one
+    """
+    with connection.begin():
+        connection.execute(outbox.delete().where(outbox.c.id.in_(published_ids)))
+
+
+def relay_batch(connection: Any, publisher: "RabbitPublisher", batch_size: int) -> int:
+    """
+    Publish the oldest batch of events, returns number of published events
+    """
+    rows = connection.execute(
+        sqlalchemy.select(outbox.c.id, outbox.c.payload)
+        .order_by(outbox.c.id)
+        .limit(batch_size)
+    ).fetchall()
+    if not rows:
+        return 0
+    messages = [json.loads(row.payload) for row in rows]
+    try:
+        publisher.publish_batch(messages)
+    finally:
+        published = len(rows) - len(messages)
+        if published:
+            checkpoint(connection, [row.id for row in rows[:published]])
+    return published
+
+
+def run_relay(batch_size: int, poll_interval: float) -> None:
+    # pika is needed by the relay only, add_event keeps the web workers free of it
+    import pika.exceptions  # pylint: disable=import-outside-toplevel
+    from send import rabbit_publisher  # pylint: disable=import-outside-toplevel
+
+    logging.info("Outbox relay started | batch_size: %s", batch_size)
+    attempt = 0
+    while True:
+        try:
+            with get_engine().connect() as connection:
+                published = relay_batch(connection, rabbit_publisher, batch_size)
+            attempt = 0
+        # broker down or database busy (database is locked), unpublished events stay
+        except (pika.exceptions.AMQPError, sqlalchemy.exc.SQLAlchemyError) as error:
+            delay = min(rabbit_publisher.retry_backoff * 2**attempt, 60)
+            logging.warning("Outbox relay failed, retry in %s s | error: %r", delay, error)
+            if isinstance(error, pika.exceptions.AMQPError):
+                rabbit_publisher.close()
+            time.sleep(delay)
+            attempt += 1
+            continue
+        if published < batch_size:
+            time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    run_relay(settings.outbox_batch_size, settings.outbox_poll_interval)
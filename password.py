@@ -1,16 +1,67 @@
+import argparse
+import json
 import secrets
-import secrets
-from typing import Type
+import statistics
+import time
+from typing import Any, Dict, List, Optional, Tuple, Type
 
 from passlib.context import CryptContext
+from passlib.exc import MissingBackendError
 import passlib.context
 
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+SCHEMES: tuple = ("bcrypt", "argon2")
+BCRYPT_MIN_ROUNDS: int = 10
+BCRYPT_MAX_ROUNDS: int = 16
+# passlib default, used until calibration when bcrypt_rounds is 0
+BCRYPT_DEFAULT_ROUNDS: int = 12
+
+
+def context_settings(config: Dict[str, Any]) -> dict:
+    """
+    CryptContext settings: config["scheme"] hashes new passwords,
+    hashes of the other scheme or with a lower cost need update
+    """
+    scheme = config["scheme"]
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown password scheme: {scheme}")
+    rounds = config["bcrypt_rounds"] or BCRYPT_DEFAULT_ROUNDS
+    return {
+        "schemes": [scheme] + [name for name in SCHEMES if name != scheme],
+        "deprecated": "auto",
+        "bcrypt__default_rounds": rounds,
+        "bcrypt__min_rounds": rounds,
+        "argon2__memory_cost": config["argon2_memory_cost"],
+        "argon2__time_cost": config["argon2_time_cost"],
+        "argon2__parallelism": config["argon2_parallelism"],
+    }
+
+
+password_config: Dict[str, Any] = {
+    "scheme": settings.password_scheme,
+    "bcrypt_rounds": settings.bcrypt_rounds,
+    "argon2_memory_cost": settings.argon2_memory_cost,
+    "argon2_time_cost": settings.argon2_time_cost,
+    "argon2_parallelism": settings.argon2_parallelism,
+}
 
 pwd_context: passlib.context.CryptContext = CryptContext(
-    schemes=["bcrypt"], deprecated="auto"
+    **context_settings(password_config)
 )
 
 
+def configure(config: Dict[str, Any]) -> None:
+    """
+    Replace pwd_context settings, also the hashing pool initializer
+    """
+    pwd_context.load(context_settings(config), update=False)
+    password_config.update(config)
+
+
 def password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
@@ -19,5 +70,114 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Verify password, new hash if the stored one needs update (scheme, cost)
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def generate_token() -> str:
     return secrets.token_urlsafe(32)
+
+
+def measure(context: CryptContext, samples: int = 3) -> dict:
+    """
+    Median hash and verify time in ms
+    """
+    hash_times: List[float] = []
+    verify_times: List[float] = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hashed = context.hash("benchmark password")
+        hash_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        context.verify("benchmark password", hashed)
+        verify_times.append(time.perf_counter() - start)
+    return {
+        "hash_ms": statistics.median(hash_times) * 1000,
+        "verify_ms": statistics.median(verify_times) * 1000,
+    }
+
+
+def bcrypt_context(rounds: int) -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds)
+
+
+def calibrate_bcrypt_rounds(target_ms: float) -> int:
+    """
+    Highest rounds with hash time within target_ms, every round doubles the cost
+    """
+    elapsed_ms = measure(bcrypt_context(BCRYPT_MIN_ROUNDS))["hash_ms"]
+    rounds = BCRYPT_MIN_ROUNDS
+    while rounds < BCRYPT_MAX_ROUNDS and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+    return rounds
+
+
+def configure_from_settings() -> Dict[str, Any]:
+    """
+    Calibrate bcrypt rounds when bcrypt_rounds is 0, then configure pwd_context
+    """
+    config = dict(password_config)
+    if config["scheme"] == "bcrypt" and not settings.bcrypt_rounds:
+        config["bcrypt_rounds"] = calibrate_bcrypt_rounds(
+            settings.password_hash_target_ms
+        )
+    configure(config)
+    return config
+
+
+def benchmark(target_ms: float, samples: int) -> dict:
+    """
+    Hash and verify time of bcrypt costs and the configured argon2 on this machine
+    """
+    report: Dict[str, Any] = {
+        "target_ms": target_ms,
+        "calibrated_bcrypt_rounds": calibrate_bcrypt_rounds(target_ms),
+        "schemes": [],
+    }
+    for rounds in range(BCRYPT_MIN_ROUNDS, report["calibrated_bcrypt_rounds"] + 2):
+        result = measure(bcrypt_context(rounds), samples)
+        report["schemes"].append(dict(result, scheme="bcrypt", rounds=rounds))
+    argon2 = CryptContext(
+        schemes=["argon2"],
+        argon2__memory_cost=password_config["argon2_memory_cost"],
+        argon2__time_cost=password_config["argon2_time_cost"],
+        argon2__parallelism=password_config["argon2_parallelism"],
+    )
+    try:
+        result = measure(argon2, samples)
+    except MissingBackendError:
+        result = {"error": "argon2-cffi is not installed"}
+    report["schemes"].append(
+        dict(
+            result,
+            scheme="argon2",
+            memory_cost=password_config["argon2_memory_cost"],
+            time_cost=password_config["argon2_time_cost"],
+            parallelism=password_config["argon2_parallelism"],
+        )
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Password hashing cost")
+    parser.add_argument("command", choices=["calibrate", "benchmark"])
+    parser.add_argument(
+        "--target-ms", type=float, default=settings.password_hash_target_ms
+    )
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args()
+    if args.command == "calibrate":
+        result = {
+            "target_ms": args.target_ms,
+            "bcrypt_rounds": calibrate_bcrypt_rounds(args.target_ms),
+        }
+    else:
+        result = benchmark(args.target_ms, args.samples)
+    print(json.dumps(result, indent=2))
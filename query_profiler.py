@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+FINGERPRINT_RULES: tuple = (
+    (re.compile(r"--[^\n]*"), ""),
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\(\s*__\[POSTCOMPILE_\w+\]\s*\)|__\[POSTCOMPILE_\w+\]"), "(...)"),
+    (re.compile(r"(?<![\w.:]):\w+"), "?"),
+    (re.compile(r"\$\d+"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+)
+EXPLAINABLE: tuple = ("SELECT", "UPDATE", "DELETE")
+
+
+def fingerprint(query: Any) -> str:
+    """
+    Normalize SQL: literals and bind parameters -> ?, IN lists -> (...)
+    """
+    sql = str(query)
+    for pattern, replacement in FINGERPRINT_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def redact(values: Optional[dict]) -> dict:
+    return {name: "?" for name in values} if values else {}
+
+
+class QueryProfiler:
+    """
+    InstrumentedDatabase observer: slow query log with redacted parameters,
+    optional EXPLAIN of slow queries, top-N fingerprints by total time
+    """
+
+    def __init__(self, slow_query_ms: float, top_n: int, explain: bool) -> None:
+        self.slow_query_ms = slow_query_ms
+        self.top_n = top_n
+        self.explain = explain
+        self._database: Any = None
+        self._stats: Dict[str, dict] = {}
+
+    def attach(self, database: Any) -> None:
+        """
+        Observe database, EXPLAIN runs on the first attached one (primary)
+        """
+        if self._database is None:
+            self._database = database
+        database.add_observer(self.observe)
+
+    def observe(
+        self,
+        method: str,
+        query: Any,
+        values: Optional[dict],
+        seconds: float,
+        error: bool,
+    ) -> None:
+        key = fingerprint(query)
+        if key.upper().startswith("EXPLAIN"):
+            return
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = {
+                "fingerprint": key,
+                "calls": 0,
+                "errors": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "plan": None,
+            }
+        elapsed_ms = seconds * 1000
+        stats["calls"] += 1
+        stats["errors"] += int(error)
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        if elapsed_ms < self.slow_query_ms:
+            return
+        logging.warning(
+            "Slow query | %.1f ms, %s: %s, values: %s",
+            elapsed_ms,
+            method,
+            key,
+            redact(values),
+        )
+        if self.explain and stats["plan"] is None and isinstance(query, str):
+            if key.split(" ", 1)[0].upper() in EXPLAINABLE:
+                stats["plan"] = []
+                asyncio.ensure_future(self._explain(stats, query, values))
+
+    async def _explain(self, stats: dict, query: str, values: Optional[dict]) -> None:
+        if self._database.url.dialect == "sqlite":
+            prefix = "EXPLAIN QUERY PLAN "
+        else:
+            prefix = "EXPLAIN "
+        try:
+            rows = await self._database.fetch_all(query=prefix + query, values=values)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("EXPLAIN failed | %s", stats["fingerprint"])
+            return
+        stats["plan"] = [" ".join(str(value) for value in row) for row in rows]
+        logging.warning(
+            "Slow query plan | %s\n%s", stats["fingerprint"], "\n".join(stats["plan"])
+        )
+
+    def top(self, limit: Optional[int] = None) -> List[dict]:
+        """
+        Most expensive fingerprints by total time
+        """
+        ranked = sorted(
+            self._stats.values(), key=lambda item: item["total_ms"], reverse=True
+        )
+        return [
+            dict(item, avg_ms=item["total_ms"] / item["calls"])
+            for item in ranked[: limit or self.top_n]
+        ]
+
+    def reset(self) -> None:
+        self._stats.clear()
+
+
+query_profiler: QueryProfiler = QueryProfiler(
+    settings.slow_query_ms, settings.query_profiler_top_n, settings.query_explain
+)
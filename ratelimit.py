@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import math
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+from settings import Settings, get_settings
+
+settings: Settings = get_settings()
+
+# key, limit, window seconds
+Rule = Tuple[str, int, int]
+RULE_KEYS: tuple = ("ip", "email", "ip_email")
+
+
+def parse_policy(policy: str) -> List[Rule]:
+    """
+    "ip:100/60,email:10/60" -> [("ip", 100, 60), ("email", 10, 60)]
+    """
+    rules = []
+    for item in policy.split(","):
+        if not item.strip():
+            continue
+        name, rate = item.strip().split(":")
+        limit, window = rate.split("/")
+        if name not in RULE_KEYS:
+            raise ValueError(f"Unknown rate limit key: {name}")
+        rules.append((name, int(limit), int(window)))
+    return rules
+
+
+def sliding_count(
+    window_start: float, previous: int, current: int, window: int, now: float
+) -> Tuple[float, int, int, float]:
+    """
+    Sliding window counter: previous window weighted by its overlap
+    returns window_start, previous, current rolled to now and the estimate
+    """
+    start = now - now % window
+    if start != window_start:
+        previous = current if start - window == window_start else 0
+        current = 0
+    weight = 1 - (now - start) / window
+    return start, previous, current, previous * weight + current
+
+
+def retry_after(
+    previous: int, current: int, limit: int, window: int, now: float
+) -> float:
+    """
+    Seconds until the estimate drops below limit
+    """
+    start = now - now % window
+    if current >= limit:
+        # next window: current becomes previous and decays from there
+        return start + window * (2 - limit / current) - now
+    # previous * (1 - (t - start) / window) + current < limit
+    return start + window * (1 - (limit - current) / previous) - now
+
+
+class MemoryBackend:
+    """
+    Counters in this process, every gunicorn worker has its own
+    """
+
+    def __init__(self) -> None:
+        # key -> window_start, previous, current, expires_at
+        self._counters: Dict[str, Tuple[float, int, int, float]] = {}
+        self._hits = 0
+
+    def hit(self, rules: List[Rule], now: float) -> Optional[float]:
+        """
+        Count the request for every rule if all allow it
+        returns None when allowed, else seconds to wait
+        """
+        rolled = []
+        wait: Optional[float] = None
+        for key, limit, window in rules:
+            window_start, previous, current, _ = self._counters.get(
+                key, (0.0, 0, 0, 0.0)
+            )
+            window_start, previous, current, count = sliding_count(
+                window_start, previous, current, window, now
+            )
+            if count >= limit:
+                wait = max(
+                    wait or 0.0, retry_after(previous, current, limit, window, now)
+                )
+            rolled.append(
+                (key, window_start, previous, current + 1, window_start + 2 * window)
+            )
+        if wait is not None:
+            return wait
+        for key, *counter in rolled:
+            self._counters[key] = tuple(counter)
+        self._hits += 1
+        if self._hits % 1000 == 0:
+            self.prune(now)
+        return None
+
+    def prune(self, now: float) -> None:
+        expired = [key for key, counter in self._counters.items() if counter[3] <= now]
+        for key in expired:
+            del self._counters[key]
+
+
+class SQLiteBackend:
+    """
+    Counters in a SQLite file shared by all workers on the host
+    Every check is one IMMEDIATE transaction, so workers do not race.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._hits = 0
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS rate_limits (
+                    key TEXT PRIMARY KEY,
+                    window_start REAL NOT NULL,
+                    previous INTEGER NOT NULL,
+                    current INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )""")
+        return self._connection
+
+    def hit(self, rules: List[Rule], now: float) -> Optional[float]:
+        with self._lock:
+            connection = self.connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                wait = self._hit(connection, rules, now)
+                self._hits += 1
+                if self._hits % 1000 == 0:
+                    connection.execute(
+                        "DELETE FROM rate_limits WHERE expires_at <= ?", (now,)
+                    )
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return wait
+
+    def _hit(
+        self, connection: sqlite3.Connection, rules: List[Rule], now: float
+    ) -> Optional[float]:
+        rolled = []
+        wait: Optional[float] = None
+        for key, limit, window in rules:
+            row = connection.execute(
+                "SELECT window_start, previous, current FROM rate_limits WHERE key = ?",
+                (key,),
+            ).fetchone()
+            window_start, previous, current, count = sliding_count(
+                *(row or (0.0, 0, 0)), window, now
+            )
+            if count >= limit:
+                wait = max(
+                    wait or 0.0, retry_after(previous, current, limit, window, now)
+                )
+            rolled.append(
+                (key, window_start, previous, current + 1, window_start + 2 * window)
+            )
+        if wait is not None:
+            return wait
+        connection.executemany(
+            """INSERT INTO rate_limits(key, window_start, previous, current, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET window_start = excluded.window_start,
+            previous = excluded.previous, current = excluded.current,
+            expires_at = excluded.expires_at""",
+            rolled,
+        )
+        return None
+
+
+class RateLimiter:
+    """
+    Per route policies keyed by client ip, email and ip + email
+    Checked at the start of the handler, before any database or bcrypt work.
+    """
+
+    def __init__(
+        self, backend: object, policies: Dict[str, str], enabled: bool
+    ) -> None:
+        self.backend = backend
+        self.policies = {
+            route: parse_policy(policy) for route, policy in policies.items()
+        }
+        self.enabled = enabled
+        self.rejected = 0
+
+    def rules(self, route: str, ip: str, email: Optional[str]) -> List[Rule]:
+        email = email.strip().lower() if email else None
+        values = {"ip": ip, "email": email, "ip_email": f"{ip}|{email}"}
+        return [
+            (f"{route}:{name}:{values[name]}", limit, window)
+            for name, limit, window in self.policies.get(route, [])
+            if email is not None or name == "ip"
+        ]
+
+    async def check(self, route: str, ip: str, email: Optional[str] = None) -> None:
+        """
+        Raise 429 with Retry-After when any rule of the route is exceeded
+        """
+        if not self.enabled:
+            return
+        rules = self.rules(route, ip, email)
+        if not rules:
+            return
+        if isinstance(self.backend, SQLiteBackend):
+            loop = asyncio.get_running_loop()
+            wait = await loop.run_in_executor(
+                None, self.backend.hit, rules, time.time()
+            )
+        else:
+            wait = self.backend.hit(rules, time.time())
+        if wait is None:
+            return
+        self.rejected += 1
+        logging.warning("Rate limited | route: %s, ip: %s, email: %s", route, ip, email)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, try again later.",
+            headers={"Retry-After": str(max(math.ceil(wait), 1))},
+        )
+
+
+def client_ip(request: Request) -> str:
+    """
+    Peer address, first X-Forwarded-For hop behind a trusted proxy
+    """
+    if settings.trust_forwarded_for:
+        forwarded = request.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def get_backend() -> object:
+    if settings.rate_limit_backend == "sqlite":
+        return SQLiteBackend(settings.rate_limit_path)
+    return MemoryBackend()
+
+
+rate_limiter: RateLimiter = RateLimiter(
+    get_backend(),
+    {
+        "login": settings.rate_limit_login,
+        "password_reset": settings.rate_limit_password_reset,
+    },
+    settings.rate_limit_enabled,
+)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Optional
+
+from databases import Database
+
+from metrics import TOKENS_REAPED
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+
+class TokenReaper:
+    """
+    Delete expired access tokens in bounded batches on a schedule
+    """
+
+    def __init__(self, interval: float, batch_size: int) -> None:
+        self.interval = interval
+        self.batch_size = batch_size
+        self.runs = 0
+        self.last_run_reclaimed = 0
+        self.last_run_seconds = 0.0
+        self.total_reclaimed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self, database: Database) -> int:
+        """
+        Delete expired tokens batch by batch, yield to the event loop between batches
+        """
+        start = time.perf_counter()
+        query = """
+            DELETE FROM access_tokens WHERE access_token IN (
+                SELECT access_token FROM access_tokens
+                WHERE expires_at < :now
+                LIMIT :batch_size
+            )
+            RETURNING access_token
+            """
+        reclaimed = 0
+        while True:
+            rows = await database.fetch_all(
+                query=query,
+                values={"now": int(time.time()), "batch_size": self.batch_size},
+            )
+            reclaimed += len(rows)
+            if len(rows) < self.batch_size:
+                break
+            await asyncio.sleep(0)
+        self.runs += 1
+        self.last_run_reclaimed = reclaimed
+        self.last_run_seconds = time.perf_counter() - start
+        self.total_reclaimed += reclaimed
+        TOKENS_REAPED.inc(reclaimed)
+        if reclaimed:
+            logging.info(
+                "Token reaper | reclaimed: %s, %.1f ms",
+                reclaimed,
+                self.last_run_seconds * 1000,
+            )
+        return reclaimed
+
+    async def _run(self, database: Database) -> None:
+        # spread the first run of gunicorn workers started at the same time
+        await asyncio.sleep(random.uniform(0, self.interval))
+        while True:
+            try:
+                await self.run_once(database)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Token reaper failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self, database: Database) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run(database))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "last_run_reclaimed": self.last_run_reclaimed,
+            "last_run_ms": self.last_run_seconds * 1000,
+            "total_reclaimed": self.total_reclaimed,
+        }
+
+
+token_reaper: TokenReaper = TokenReaper(
+    settings.token_reaper_interval, settings.token_reaper_batch_size
+)
@@ -0,0 +1,140 @@
+"""
+JSON responses of the app, orjson when installed
+Hot routes return fast_response(rows) and skip jsonable_encoder and
+response_model validation, their response_model still documents them.
+    python responses.py --iterations 20000
+"""
+
+import argparse
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models.users import TokenIntrospection, UserDB
+from settings import Settings, get_settings
+
+try:
+    import orjson
+except ImportError:  # optional, responses fall back to the json module
+    orjson = None
+
+
+settings: Settings = get_settings()
+
+RESPONSE_CLASSES: Dict[str, Type[JSONResponse]] = {
+    "orjson": ORJSONResponse,
+    "json": JSONResponse,
+}
+
+
+def get_response_class(name: str) -> Type[JSONResponse]:
+    if name not in RESPONSE_CLASSES:
+        raise ValueError(f"Unknown json response: {name}")
+    if name == "orjson" and orjson is None:
+        logging.warning("orjson is not installed, json responses use the json module")
+        return JSONResponse
+    return RESPONSE_CLASSES[name]
+
+
+response_class: Type[JSONResponse] = get_response_class(settings.json_response)
+
+
+def fast_response(
+    content: Any, status_code: int = 200, headers: Optional[dict] = None
+) -> JSONResponse:
+    """
+    Serialize dicts and lists built from database rows as they are
+    The route has to return exactly its response_model fields, nothing checks them.
+    """
+    if response_class is ORJSONResponse:
+        return ORJSONResponse(content, status_code=status_code, headers=headers)
+    # json module needs datetimes as strings
+    return JSONResponse(
+        jsonable_encoder(content), status_code=status_code, headers=headers
+    )
+
+
+def run_coroutine(coroutine: Any) -> Any:
+    """
+    Result of a coroutine which never suspends, without an event loop
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError("coroutine suspended")
+
+
+def measure(render: Callable[[], Any], iterations: int) -> float:
+    """
+    CPU microseconds per call
+    """
+    start = time.process_time()
+    for _ in range(iterations):
+        render()
+    return (time.process_time() - start) / iterations * 1_000_000
+
+
+def benchmark(iterations: int) -> List[dict]:
+    """
+    Default FastAPI path (response_model validation and jsonable_encoder)
+    against fast_response for payloads of the hot routes, both rendered
+    with response_class
+    """
+    expiration_date = datetime.now() + timedelta(minutes=30)
+    introspection = {
+        "token": "Bearer " + "x" * 43,
+        "active": True,
+        "id": 1,
+        "email": "user@example.com",
+        "username": "user",
+        "expiration_date": expiration_date,
+    }
+    users = [
+        {"id": i, "username": f"user{i}", "email": f"user{i}@example.com"}
+        for i in range(100)
+    ]
+    payloads = [
+        ("check-token", TokenIntrospection, introspection),
+        ("check-tokens x100", List[TokenIntrospection], [introspection] * 100),
+        ("list x100", List[UserDB], users),
+    ]
+    report = []
+    for name, model, content in payloads:
+        field = create_response_field(name="response", type_=model)
+
+        def default() -> Any:
+            value = run_coroutine(
+                serialize_response(field=field, response_content=content)
+            )
+            return response_class(value).body
+
+        def fast() -> Any:
+            return fast_response(content).body
+
+        default_us = measure(default, iterations)
+        fast_us = measure(fast, iterations)
+        report.append(
+            {
+                "payload": name,
+                "response_class": response_class.__name__,
+                "default_us": round(default_us, 1),
+                "fast_us": round(fast_us, 1),
+                "saved_percent": round((1 - fast_us / default_us) * 100, 1),
+            }
+        )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON response CPU per request")
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.iterations), indent=2))
@@ -1,11 +1,22 @@
+import json
 import logging
 import random
 from datetime import datetime
 import logging
-from typing import Any, Coroutine, Type, Union, List
+from typing import Any, AsyncIterator, Coroutine, Type, Union, List, Optional
 
 from sqlalchemy.sql.schema import MetaData
-from fastapi import APIRouter, HTTPException, status, Depends, Body
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    status,
+    Depends,
+    Body,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
 from databases import Database
 
@@ -20,13 +31,30 @@ from models.users import (
     UserUpdate,
     EmailConfirm,
     PasswordConfirm,
+    TokenUser,
+    TokenBatch,
+    TokenIntrospection,
+    USER_PUBLIC_FIELDS,
+)
+from db import get_database, get_db_router, get_read_database, INTEGRITY_ERRORS
+from hashing import async_password_hash, hashing_executor
+from importer import IMPORT_FORMATS, UserImporter, aiter_lines
+from exporter import EXPORT_FORMATS, MEDIA_TYPES, export_users
+from cache import token_cache
+from email_filter import email_filter
+from tokens import signed_tokens_enabled, token_signer
+from authentication import (
+    authenticate,
+    create_access_token,
+    resolve_tokens,
 )
-from db import get_database
-from password import password_hash, verify_password
-from authentication import authenticate, create_access_token
 from email_service import email_service
-from send import rabbit_queue
+from outbox import add_event
+from ratelimit import client_ip, rate_limiter
+from responses import fast_response
+from settings import Settings, get_settings
 
+settings: Settings = get_settings()
 users_router: Any = APIRouter()
 api_key_header: Any = APIKeyHeader(name="Authorization")
 logging.basicConfig(level=logging.INFO)
@@ -34,25 +62,31 @@ logging.basicConfig(level=logging.INFO)
 
 async def get_current_user(
     token: str = Depends(api_key_header),
-    database: Database = Depends(get_database),
-) -> UserDB:
+    database: Database = Depends(get_read_database),
+) -> TokenUser:
     """
     Get current user by verification  'Authorization' header token and time
+    Signed tokens are verified locally, opaque tokens via access_tokens
+    on a replica, unknown tokens are rechecked on the primary
     """
     raw_token = token[7:]
-    query = """
-        SELECT access_tokens.expiration_date, access_tokens.access_token, users.id, users.email, users.username
-        FROM access_tokens
-        JOIN users ON access_tokens.user_id = users.id
-        WHERE access_token = :access_token
-        """
-    user_db = await database.fetch_one(query=query, values={"access_token": raw_token})
-    if not user_db:
+    current_user = (await resolve_tokens(database, [raw_token]))[raw_token]
+    if current_user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-    date_check = datetime.strptime(str(user_db.expiration_date), "%Y-%m-%d %H:%M:%S.%f")
-    if date_check < datetime.now():
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-    return user_db
+    return current_user
+
+
+async def get_admin_user(
+    user: TokenUser = Depends(get_current_user),
+    database: Database = Depends(get_database),
+) -> TokenUser:
+    """
+    Current user if it is an admin or 403
+    """
+    query = """SELECT is_admin FROM users WHERE id = :id"""
+    if not await database.fetch_val(query=query, values={"id": user.id}):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    return user
 
 
 async def get_user_by_email(
@@ -81,18 +115,20 @@ async def register(
     email, pasword, username
     """
     logging.info("User signup | email: %s", user.email)
-    query = "SELECT * FROM users WHERE email = :email"
-    result = await database.fetch_one(query=query, values={"email": user.email})
-    if result:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT, detail="Email already exists."
-        )
+    if email_filter.might_contain(user.email):
+        # skip hashing for a taken email, the insert still checks the rest
+        query = """SELECT id FROM users WHERE email = :email"""
+        if await database.fetch_one(query=query, values={"email": user.email}):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail="Email already exists."
+            )
     query = """
         INSERT INTO users(username, email, password, verified, verification_code, is_admin)
         VALUES (:username, :email, :password, :verified, :verification_code, :is_admin)
+        RETURNING id, username, email
         """
     verification_code = random.randint(1000, 9999)
-    hashed_password = password_hash(user.password)
+    hashed_password = await async_password_hash(user.password)
     values = {
         "username": user.username,
         "email": user.email,
@@ -101,12 +137,19 @@ async def register(
         "verification_code": verification_code,
         "is_admin": 0,
     }
-    await database.execute(query=query, values=values)
+    try:
+        async with database.transaction():
+            refresh_user = await database.fetch_one(query=query, values=values)
+            await add_event(
+                database, {"registered": refresh_user.id, "email": user.email}
+            )
+    except INTEGRITY_ERRORS:
+        # unique index on users.email
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Email already exists."
+        )
+    email_filter.add(user.email)
     email_service(str(verification_code), user.email)
-    refresh_query = """SELECT id, username, email FROM users WHERE email = :email"""
-    refresh_user = await database.fetch_one(
-        query=refresh_query, values={"email": user.email}
-    )
     logging.info("New user | email: %s, code: %s", user.email, verification_code)
     return refresh_user
 
@@ -141,12 +184,14 @@ async def registration_confirmation(
 @users_router.post("/login")
 async def create_token(
     user: UserLogin,
+    request: Request,
 ) -> dict:
     """
     User login
     returns access_token, token_type
     """
     logging.info("User login | email: %s", user.email)
+    await rate_limiter.check("login", client_ip(request), user.email)
     email = user.email
     password = user.password
     user_db = await authenticate(email, password)
@@ -157,28 +202,39 @@ async def create_token(
 
 
 @users_router.get("/user", response_model=UserBase, status_code=status.HTTP_200_OK)
-async def user_self_info(user: UserDB = Depends(get_current_user)) -> dict:
+async def user_self_info(user: UserDB = Depends(get_current_user)) -> Response:
     """
     Get current user info
     """
-    return user
+    return fast_response({"email": user.email, "username": user.username})
 
 
 @users_router.patch("/user", response_model=UserBase, status_code=status.HTTP_200_OK)
 async def user_update(
     user_info: UserUpdate,
+    response: Response,
     user: UserDB = Depends(get_current_user),
     database: Database = Depends(get_database),
 ) -> UserBase:
     """
     Update current_user username
+    Signed tokens are reissued, the new one is in the X-Access-Token header
     """
-    query = """UPDATE users SET username = :username WHERE users.id = :id"""
-    await database.execute(
+    query = """
+        UPDATE users SET username = :username WHERE users.id = :id
+        RETURNING email, username
+        """
+    refresh_user = await database.fetch_one(
         query=query, values={"username": user_info.username, "id": user.id}
     )
-    query_refresh = """SELECT email, username FROM users WHERE id = :id"""
-    refresh_user = await database.fetch_one(query=query_refresh, values={"id": user.id})
+    token_cache.invalidate_user(user.id)
+    get_db_router().mark_write(user.access_token)
+    if signed_tokens_enabled():
+        # the token carries the old username, replace it
+        token = await create_access_token(
+            UserDB(id=user.id, email=refresh_user.email, username=refresh_user.username)
+        )
+        response.headers["X-Access-Token"] = token.access_token
     return refresh_user
 
 
@@ -189,16 +245,22 @@ async def user_delete(
     """
     Delete current_user
     """
-    query = """DELETE FROM access_tokens WHERE user_id = :id"""
-    await database.execute(query=query, values={"id": user.id})
-    query = """DELETE FROM users WHERE id = :id"""
-    await database.execute(query=query, values={"id": user.id})
-    rabbit_queue({"deleted": user.id})
+    async with database.transaction():
+        query = """DELETE FROM access_tokens WHERE user_id = :id"""
+        await database.execute(query=query, values={"id": user.id})
+        query = """DELETE FROM users WHERE id = :id"""
+        await database.execute(query=query, values={"id": user.id})
+        await add_event(database, {"deleted": user.id})
+    token_cache.invalidate_user(user.id)
+    get_db_router().mark_write(user.access_token)
+    if signed_tokens_enabled():
+        token_signer.revoke_user(user.id)
     return {"deleted": user.id}
 
 
 @users_router.post("/password-reset", status_code=status.HTTP_200_OK)
 async def password_reset(
+    request: Request,
     email: str = Body(embed=True),
     database: Database = Depends(get_database),
 ) -> str:
@@ -206,6 +268,7 @@ async def password_reset(
     Password reset by email
     with sending new verification code to the email
     """
+    await rate_limiter.check("password_reset", client_ip(request), email)
     user_db: UserDB
     user_db = await get_user_by_email(email, database)
     code = random.randint(1000, 9999)
@@ -230,7 +293,7 @@ async def password_confirm(
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Wrong verification code."
         )
-    hashed_password = password_hash(password)
+    hashed_password = await async_password_hash(password)
     query = """UPDATE users SET password = :password WHERE id = :id"""
     await database.execute(
         query=query, values={"password": hashed_password, "id": user_db.id}
@@ -246,16 +309,24 @@ async def email_reset(
 ) -> str:
     """
     Email reset for users
+    The code confirms only this new_email, a new request replaces it.
     """
     new_code = random.randint(1000, 9999)
-    query = """UPDATE users SET verification_code = :code WHERE id = :id"""
-    await database.execute(query=query, values={"code": new_code, "id": user.id})
+    query = """
+        UPDATE users SET verification_code = :code, pending_email = :email
+        WHERE id = :id
+        """
+    await database.execute(
+        query=query, values={"code": new_code, "email": new_email, "id": user.id}
+    )
+    get_db_router().mark_write(user.access_token)
     email_service(str(new_code), new_email)
     return f"Verification code was sended to {new_email}"
 
 
 @users_router.post("/email-confirm")
 async def user_email_conf(
+    response: Response,
     user: UserDB = Depends(get_current_user),
     new_email: str = Body(embed=True),
     code: str = Body(embed=True),
@@ -263,13 +334,41 @@ async def user_email_conf(
 ) -> dict:
     """
     Email reset confirmation
+    new_email and code must match the last email reset, the code works once.
+    Signed tokens are reissued, the new one is in the X-Access-Token header
     """
-    query = """SELECT verification_code FROM users WHERE id = :id"""
-    user_code = await database.fetch_one(query=query, values={"id": user.id})
-    if code != user_code:
+    if not code.isdigit():
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Wrong code.")
-    query = """UPDATE users SET email = :email WHERE id = :id"""
-    await database.execute(query=query, values={"email": new_email, "id": user.id})
+    query = """
+        UPDATE users SET email = pending_email, pending_email = NULL,
+        verification_code = NULL
+        WHERE id = :id AND pending_email = :email AND verification_code = :code
+        RETURNING email
+        """
+    try:
+        async with database.transaction():
+            changed = await database.fetch_one(
+                query=query,
+                values={"id": user.id, "email": new_email, "code": int(code)},
+            )
+            if changed is not None:
+                event = {"email_changed": user.id, "email": new_email}
+                await add_event(database, event)
+    except INTEGRITY_ERRORS:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Email already exists."
+        )
+    if changed is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Wrong code.")
+    email_filter.add(new_email)
+    token_cache.invalidate_user(user.id)
+    get_db_router().mark_write(user.access_token)
+    if signed_tokens_enabled():
+        # the token carries the old email, replace it
+        token = await create_access_token(
+            UserDB(id=user.id, email=new_email, username=user.username)
+        )
+        response.headers["X-Access-Token"] = token.access_token
     return {"new_email": new_email}
 
 
@@ -283,25 +382,63 @@ async def user_logout(
     """
     query = """DELETE FROM access_tokens WHERE access_token = :token"""
     await database.execute(query=query, values={"token": user.access_token})
+    token_cache.invalidate(user.access_token)
+    get_db_router().mark_write(user.access_token)
+    if signed_tokens_enabled():
+        token_signer.revoke(user.access_token)
     return {user.email: "logout"}
 
 
 @users_router.post("/check-token")
 async def check_token(
     user: UserDB = Depends(get_current_user),
-    database: Database = Depends(get_database),
+    database: Database = Depends(get_read_database),
 ):
     """
     Check user token for others services
     """
-    return user
+    return fast_response(user.dict())
+
+
+@users_router.post("/check-tokens", response_model=List[TokenIntrospection])
+async def check_tokens(
+    batch: TokenBatch, database: Database = Depends(get_read_database)
+) -> Response:
+    """
+    Check a batch of tokens for others services, one database query
+    Same rules as check-token, "Bearer " prefix is optional
+    """
+    if len(batch.tokens) > settings.introspection_max_tokens:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Too many tokens, max {settings.introspection_max_tokens}.",
+        )
+    raw_tokens = [
+        token[7:] if token.startswith("Bearer ") else token for token in batch.tokens
+    ]
+    resolved = await resolve_tokens(database, list(dict.fromkeys(raw_tokens)))
+    result = []
+    for token, raw_token in zip(batch.tokens, raw_tokens):
+        user = resolved[raw_token]
+        # TokenIntrospection fields, serialized without the model
+        result.append(
+            {
+                "token": token,
+                "active": user is not None,
+                "id": user and user.id,
+                "email": user and user.email,
+                "username": user and user.username,
+                "expiration_date": user and user.expiration_date,
+            }
+        )
+    return fast_response(result)
 
 
 """Admin service"""
 
 
 @users_router.post("/user/{id}")
-async def user_get_info(id: int, database: Database = Depends(get_database)):
+async def user_get_info(id: int, database: Database = Depends(get_read_database)):
     """
     TODO: Get user info by id, for admin service
     """
@@ -310,14 +447,137 @@ async def user_get_info(id: int, database: Database = Depends(get_database)):
     return user_db
 
 
+def parse_fields(fields: str, with_id: bool = True) -> List[str]:
+    """
+    Validate requested users columns, password is never selectable
+    with_id adds id for routes paging by it
+    """
+    columns = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [column for column in columns if column not in USER_PUBLIC_FIELDS]
+    if not columns or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Unknown fields: {', '.join(unknown)}. "
+            f"Available: {', '.join(USER_PUBLIC_FIELDS)}",
+        )
+    if with_id and "id" not in columns:
+        columns.insert(0, "id")
+    return columns
+
+
 @users_router.get("/list")
 async def list_users(
-    user: UserDB = Depends(get_current_user), database: Database = Depends(get_database)
-) -> List[UserDB]:
-    """
-    List of all users
+    after_id: int = Query(default=0, ge=0),
+    limit: Optional[int] = Query(default=None, ge=1),
+    fields: str = "id,username,email",
+    format: str = Query(default="json", regex="^(json|ndjson)$"),
+    user: UserDB = Depends(get_current_user),
+    database: Database = Depends(get_read_database),
+) -> Any:
+    """
+    List of users ordered by id, keyset pagination by after_id
+    json - one page, X-Next-Cursor header holds after_id of the next page
+    ndjson - stream every user after after_id, limit is optional, read in
+    pages of list_max_page_size so no connection is held between pages
+    """
+    columns = parse_fields(fields)
+    query = f"""
+        SELECT {", ".join(columns)} FROM users
+        WHERE id > :after_id ORDER BY id LIMIT :limit
+        """
+    if format == "ndjson":
+
+        async def stream_users() -> AsyncIterator[str]:
+            last_id, left = after_id, limit
+            while left is None or left > 0:
+                page_size = settings.list_max_page_size
+                if left is not None:
+                    page_size = min(page_size, left)
+                    left -= page_size
+                rows = await database.fetch_all(
+                    query=query, values={"after_id": last_id, "limit": page_size}
+                )
+                if rows:
+                    yield "".join(json.dumps(dict(row._mapping)) + "\n" for row in rows)
+                if len(rows) < page_size:
+                    return
+                last_id = rows[-1].id
+
+        return StreamingResponse(stream_users(), media_type="application/x-ndjson")
+    values = {
+        "after_id": after_id,
+        "limit": min(limit or settings.list_page_size, settings.list_max_page_size),
+    }
+    rows = await database.fetch_all(query=query, values=values)
+    result = [dict(row._mapping) for row in rows]
+    headers = {}
+    if len(result) == values["limit"]:
+        headers["X-Next-Cursor"] = str(result[-1]["id"])
+    return fast_response(result, headers=headers)
+
+
+@users_router.post("/import")
+async def import_users(
+    request: Request,
+    format: str = Query(default="jsonl", regex=f"^({'|'.join(IMPORT_FORMATS)})$"),
+    start_line: int = Query(default=0, ge=0),
+    user: TokenUser = Depends(get_admin_user),
+    database: Database = Depends(get_database),
+) -> dict:
     """
-    users_db = users.select()
-    rows = await database.fetch_all(users_db)
-    result = [UserDB(**row) for row in rows]
-    return result
+    Bulk import of users from the streamed request body, admin only
+    jsonl or csv with header: email, username, password or password_hash,
+    verified, is_admin. Resume a failed upload with start_line=last_line.
+    """
+    logging.info("User import | admin: %s, start_line: %s", user.email, start_line)
+    importer = UserImporter(
+        database,
+        hashing_executor,
+        chunk_size=settings.import_chunk_size,
+        concurrency=settings.import_concurrency,
+        max_errors_kept=settings.import_max_errors_reported,
+    )
+    report = await importer.run(aiter_lines(request.stream()), format, start_line)
+    logging.info(
+        "User import done | imported: %s, errors: %s",
+        report["imported"],
+        report["errors"],
+    )
+    return report
+
+
+@users_router.get("/export")
+async def export_users_stream(
+    fields: str = "id,username,email",
+    format: str = Query(default="ndjson", regex=f"^({'|'.join(EXPORT_FORMATS)})$"),
+    gzip: bool = False,
+    verified: Optional[bool] = None,
+    is_admin: Optional[bool] = None,
+    min_id: Optional[int] = Query(default=None, ge=0),
+    max_id: Optional[int] = Query(default=None, ge=0),
+    user: TokenUser = Depends(get_admin_user),
+    database: Database = Depends(get_read_database),
+) -> StreamingResponse:
+    """
+    Stream public users columns for analytics, admin only
+    Rows are read in keyset batches, filters run in SQL, gzip compresses
+    the stream as a .gz file.
+    """
+    # export_batches selects id for paging on its own
+    columns = parse_fields(fields, with_id=False)
+    logging.info("User export | admin: %s, format: %s", user.email, format)
+    filename = f"users.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_users(
+            database,
+            columns,
+            format,
+            compress=gzip,
+            verified=verified,
+            is_admin=is_admin,
+            min_id=min_id,
+            max_id=max_id,
+        ),
+        media_type="application/gzip" if gzip else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
@@ -1,23 +1,74 @@
-import pika
 import json
 import logging
+import time
+from typing import Any, List
+
+import pika
+import pika.exceptions
 
-from settings import Settings
+from metrics import RABBIT_MESSAGES, RABBIT_PUBLISH_DURATION
+from settings import Settings, get_settings
 
 
-settings: Settings = Settings()
+settings: Settings = get_settings()
 logging.basicConfig(level=logging.INFO)
 
 
-def rabbit_queue(message: dict) -> None:
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(host=settings.Rabbit_host)
-    )
-    channel = connection.channel()
-    channel.queue_declare(queue=str(settings.Rabbit_chanel))
+class RabbitPublisher:
+    """
+    Publish batches with confirms over one long-lived channel
+    The outbox relay calls publish_batch and closes the connection on
+    broker errors, the next batch reconnects.
+    """
+
+    def __init__(self, host: str, routing_key: str, retry_backoff: float) -> None:
+        self.host = host
+        self.routing_key = routing_key
+        self.retry_backoff = retry_backoff
+        self.published = 0
+        self._connection: Any = None
+        self._channel: Any = None
+
+    def _connect(self) -> None:
+        self._connection = pika.BlockingConnection(
+            pika.ConnectionParameters(host=self.host)
+        )
+        self._channel = self._connection.channel()
+        self._channel.queue_declare(queue=self.routing_key)
+        self._channel.confirm_delivery()
+
+    def close(self) -> None:
+        if self._connection is not None and self._connection.is_open:
+            try:
+                self._connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+        self._connection = None
+        self._channel = None
+
+    def publish_batch(self, messages: List[dict]) -> None:
+        """
+        Publish messages in order, published messages are removed from the list
+        """
+        start = time.perf_counter()
+        try:
+            if self._channel is None or self._channel.is_closed:
+                self._connect()
+            while messages:
+                body = json.dumps(messages[0])
+                self._channel.basic_publish(
+                    exchange="", routing_key=self.routing_key, body=body
+                )
+                logging.info("Send message: %s", body)
+                messages.pop(0)
+                self.published += 1
+                RABBIT_MESSAGES.labels("published").inc()
+        finally:
+            RABBIT_PUBLISH_DURATION.observe(time.perf_counter() - start)
+
 
-    channel.basic_publish(
-        exchange="", routing_key=str(settings.Rabbit_chanel), body=json.dumps(message)
-    )
-    logging.info("Send message: %s", json.dumps(message))
-    connection.close()
+rabbit_publisher: RabbitPublisher = RabbitPublisher(
+    host=settings.Rabbit_host,
+    routing_key=str(settings.Rabbit_chanel),
+    retry_backoff=settings.rabbit_retry_backoff,
+)
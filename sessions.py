@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from databases import Database
+
+from cache import token_cache
+from metrics import SESSIONS_EXTENDED
+from models.users import TokenUser
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+
+class SessionExtender:
+    """
+    Sliding expiry of opaque access tokens with coalesced write-back
+    A token used after refresh_fraction of its lifetime is queued to live
+    lifetime seconds from its last use. The queue keeps one entry per token
+    and is written every flush_interval with batched UPDATEs, so a busy
+    session costs one write per refresh window instead of one per request.
+    Signed tokens carry their expiry in the signature and are not extended.
+    """
+
+    def __init__(
+        self,
+        lifetime: int,
+        refresh_fraction: float,
+        flush_interval: float,
+        batch_size: int,
+        enabled: bool,
+    ) -> None:
+        self.lifetime = lifetime
+        self.refresh_after = lifetime * refresh_fraction
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self.touched = 0
+        self.extended = 0
+        self.flushes = 0
+        # access_token -> new expires_at
+        self._pending: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, user: TokenUser) -> None:
+        """
+        Queue the extension of a token which used up refresh_fraction of its lifetime
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        expires_at = user.expiration_date.timestamp()
+        if expires_at - now > self.lifetime - self.refresh_after:
+            return
+        self.touched += 1
+        self._pending[user.access_token] = int(now + self.lifetime)
+
+    async def flush(self, database: Database) -> int:
+        """
+        Write queued extensions in batches, returns number of tokens extended
+        Tokens deleted or replaced meanwhile simply match no row.
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        items = list(pending.items())
+        # never shorten a token extended by another worker
+        query = """
+            UPDATE access_tokens SET expires_at = :expires_at
+            WHERE access_token = :access_token AND expires_at < :expires_at
+            """
+        start = time.perf_counter()
+        try:
+            for index in range(0, len(items), self.batch_size):
+                batch: List[dict] = [
+                    {"access_token": token, "expires_at": expires_at}
+                    for token, expires_at in items[index : index + self.batch_size]
+                ]
+                await database.execute_many(query=query, values=batch)
+                await asyncio.sleep(0)
+        except Exception:
+            # retry with the next flush, newer extensions win
+            for token, expires_at in pending.items():
+                self._pending[token] = max(self._pending.get(token, 0), expires_at)
+            raise
+        for token in pending:
+            # cached users carry the old expiration_date
+            token_cache.invalidate(token)
+        self.flushes += 1
+        self.extended += len(pending)
+        SESSIONS_EXTENDED.inc(len(pending))
+        logging.info(
+            "Sessions extended | tokens: %s, %.1f ms",
+            len(pending),
+            (time.perf_counter() - start) * 1000,
+        )
+        return len(pending)
+
+    async def _run(self, database: Database) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush(database)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Session flush failed")
+
+    def start(self, database: Database) -> None:
+        if self._task is None and self.enabled and self.flush_interval > 0:
+            self._task = asyncio.create_task(self._run(database))
+
+    async def stop(self, database: Database) -> None:
+        """
+        Cancel the flush loop and write what is queued
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush(database)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "touched": self.touched,
+            "extended": self.extended,
+            "flushes": self.flushes,
+        }
+
+
+session_extender: SessionExtender = SessionExtender(
+    settings.token_lifetime,
+    settings.session_refresh_fraction,
+    settings.session_flush_interval,
+    settings.session_flush_batch_size,
+    settings.session_sliding,
+)
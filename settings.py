@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from pydantic import BaseSettings
 
 
@@ -11,6 +13,82 @@ class Settings(BaseSettings):
     TEST: str
     Rabbit_host: str
     Rabbit_chanel: str
+    hash_pool_size: int = 2
+    hash_queue_size: int = 64
+    token_cache_size: int = 10000
+    token_cache_ttl: int = 30
+    token_cache_backend: str = "shared"
+    token_cache_path: str = "/tmp/auth_service_tokens.cache"
+    token_mode: str = "opaque"
+    token_keys: str = ""
+    token_key_id: str = "default"
+    token_lifetime: int = 86400
+    token_revocation_path: str = "/tmp/auth_service_revocations"
+    token_revocation_slots: int = 1048576
+    email_transport: str = "smtp"
+    email_batch_size: int = 20
+    email_max_retries: int = 5
+    email_retry_backoff: float = 1.0
+    email_queue_size: int = 1000
+    rabbit_retry_backoff: float = 1.0
+    outbox_batch_size: int = 500
+    outbox_poll_interval: float = 1.0
+    list_page_size: int = 100
+    list_max_page_size: int = 1000
+    introspection_max_tokens: int = 500
+    token_reaper_interval: float = 300
+    token_reaper_batch_size: int = 1000
+    session_sliding: bool = True
+    session_refresh_fraction: float = 0.5
+    session_flush_interval: float = 10.0
+    session_flush_batch_size: int = 500
+    query_profiler: bool = False
+    slow_query_ms: float = 100
+    query_profiler_top_n: int = 20
+    query_explain: bool = False
+    db_pool_min_size: int = 1
+    db_pool_max_size: int = 10
+    db_acquire_timeout: float = 10.0
+    db_statement_cache_size: int = 100
+    db_create_schema: bool = False
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout: int = 5000
+    sqlite_mmap_size: int = 268435456
+    sqlite_cache_size: int = -16000
+    database_replicas: str = ""
+    replica_health_interval: float = 5.0
+    replica_sticky_seconds: float = 5.0
+    rate_limit_enabled: bool = True
+    rate_limit_backend: str = "memory"
+    rate_limit_path: str = "/tmp/auth_service_rate_limit.db"
+    rate_limit_login: str = "ip:100/60,email:10/60,ip_email:5/60"
+    rate_limit_password_reset: str = "ip:20/3600,email:3/900"
+    trust_forwarded_for: bool = False
+    password_scheme: str = "bcrypt"
+    bcrypt_rounds: int = 12
+    password_hash_target_ms: float = 250
+    argon2_memory_cost: int = 65536
+    argon2_time_cost: int = 3
+    argon2_parallelism: int = 2
+    email_filter_enabled: bool = True
+    email_filter_path: str = "/tmp/auth_service_emails.bloom"
+    email_filter_capacity: int = 1000000
+    email_filter_error_rate: float = 0.01
+    email_filter_rebuild_interval: float = 3600
+    import_chunk_size: int = 500
+    import_concurrency: int = 4
+    import_max_errors_reported: int = 1000
+    export_batch_size: int = 1000
+    json_response: str = "orjson"
 
     class Config:
-        env_file = ".env"
\ No newline at end of file
+        env_file = ".env"
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    """
+    Settings of the process, .env and the environment are read once
+    """
+    return Settings()
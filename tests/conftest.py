@@ -7,10 +7,10 @@ import requests
 
 from password import password_hash, verify_password
 from authentication import authenticate, create_access_token
-from settings import Settings  # type: ignore
+from settings import Settings, get_settings  # type: ignore
 
 
-settings: Settings = Settings()
+settings: Settings = get_settings()
 
 
 # TESTING = os.getenv("TEST")
@@ -20,6 +20,9 @@ settings: Settings = Settings()
 #     database_path = "users.db"
 
 
+# the tests call a server started with make test-server: fixtures log the
+# same users in for every test and insert users straight into the database,
+# so rate limits and the email filter are off there
 @pytest.fixture(scope="session")
 def backend():
     return "http://0.0.0.0:8000"
@@ -33,6 +36,7 @@ def database():
     cur = con.cursor()
     cur.execute("DELETE FROM access_tokens")
     cur.execute("DELETE FROM users")
+    cur.execute("DELETE FROM outbox")
     con.commit()
     con.close()
 
@@ -162,3 +166,42 @@ def user_token(database):
         database.commit()
     except:
         pass
+
+
+@pytest.fixture(scope="function")
+def admin_token(database):
+    data = {
+        "email": "pytest_admin@gmail.com",
+        "password": password_hash("password"),
+        "username": "Admin",
+        "verified": 1,
+        "verification_code": random.randint(1000, 9999),
+        "is_admin": 1,
+    }
+    cur = database.cursor()
+    cur.execute(
+        """
+        INSERT INTO users(username, email, password, verified, verification_code, is_admin)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (
+            data["username"],
+            data["email"],
+            data["password"],
+            data["verified"],
+            data["verification_code"],
+            data["is_admin"],
+        ),
+    )
+    database.commit()
+    raw_token = requests.post(
+        f"{settings.BACKEND}/users/login",
+        json={"email": data["email"], "password": "password"},
+    )
+    yield {"token": raw_token.json()["access_token"], "data": data}
+    user_id = cur.execute(
+        "SELECT id FROM users WHERE email = ?", (data["email"],)
+    ).fetchone()
+    cur.execute("DELETE FROM access_tokens WHERE user_id = ?", (user_id[0],))
+    cur.execute("DELETE FROM users WHERE email = ?", (data["email"],))
+    database.commit()
@@ -0,0 +1,169 @@
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from cache import SharedTokenCache, TokenCache, VERSION
+from models.users import TokenUser
+
+
+def test_token_cache_hit_and_miss() -> None:
+    """
+    GIVEN token cache with one entry
+    WHEN get cached and unknown tokens
+    THEN check value returned for cached token, hit/miss counters
+    """
+    cache = TokenCache(max_size=10, ttl=60)
+    cache.set("token", {"id": 1}, 1, time.time() + 3600)
+    assert cache.get("token") == {"id": 1}
+    assert cache.get("unknown") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_token_cache_respects_token_expiration() -> None:
+    """
+    GIVEN token cache entry with expired token
+    WHEN get token
+    THEN check entry is not returned
+    """
+    cache = TokenCache(max_size=10, ttl=60)
+    cache.set("token", {"id": 1}, 1, time.time() - 1)
+    assert cache.get("token") is None
+
+
+def test_token_cache_lru_eviction() -> None:
+    """
+    GIVEN full token cache
+    WHEN add a new entry
+    THEN check least recently used entry is evicted
+    """
+    cache = TokenCache(max_size=2, ttl=60)
+    expires_at = time.time() + 3600
+    cache.set("a", 1, 1, expires_at)
+    cache.set("b", 2, 2, expires_at)
+    cache.get("a")
+    cache.set("c", 3, 3, expires_at)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_token_cache_invalidate_user() -> None:
+    """
+    GIVEN token cache with tokens of two users
+    WHEN invalidate first user
+    THEN check only first user tokens are removed
+    """
+    cache = TokenCache(max_size=10, ttl=60)
+    expires_at = time.time() + 3600
+    cache.set("a", 1, 1, expires_at)
+    cache.set("b", 2, 2, expires_at)
+    cache.invalidate_user(1)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def token_user(user_id: int, token: str, email: str = "user@example.com") -> TokenUser:
+    return TokenUser(
+        id=user_id,
+        email=email,
+        username="user",
+        access_token=token,
+        expiration_date=datetime.fromtimestamp(int(time.time()) + 3600),
+    )
+
+
+def test_shared_token_cache_between_workers(tmp_path) -> None:
+    """
+    GIVEN two shared caches on one file, as two gunicorn workers
+    WHEN one caches tokens, the other invalidates a token and a user
+    THEN check every change is visible to both at once
+    """
+    path = str(tmp_path / "tokens.cache")
+    first = SharedTokenCache(path, max_size=100, ttl=60)
+    second = SharedTokenCache(path, max_size=100, ttl=60)
+    expires_at = int(time.time()) + 3600
+    for user_id, token in ((1, "a"), (1, "b"), (2, "c")):
+        first.set(token, token_user(user_id, token), user_id, expires_at)
+    assert second.get("a") == token_user(1, "a")
+    second.invalidate("a")
+    assert first.get("a") is None
+    assert first.get("b") is not None
+    second.invalidate_user(1)
+    assert first.get("b") is None
+    assert first.get("c") == token_user(2, "c")
+    time.sleep(0.001)
+    first.set("b", token_user(1, "b"), 1, expires_at)
+    assert second.get("b") is not None
+
+
+def test_shared_token_cache_drops_values_read_before_invalidation(tmp_path) -> None:
+    """
+    GIVEN user read from the database by one worker
+    WHEN another worker invalidates the user before the first caches the read
+    THEN check the stale value is a miss, a value read later is a hit
+    """
+    path = str(tmp_path / "tokens.cache")
+    first = SharedTokenCache(path, max_size=100, ttl=60)
+    second = SharedTokenCache(path, max_size=100, ttl=60)
+    expires_at = int(time.time()) + 3600
+    read_at = time.time()
+    time.sleep(0.001)
+    second.invalidate_user(1)
+    first.set("a", token_user(1, "a"), 1, expires_at, cached_at=read_at)
+    assert second.get("a") is None
+    time.sleep(0.001)
+    first.set("a", token_user(1, "a"), 1, expires_at, cached_at=time.time())
+    assert second.get("a") == token_user(1, "a")
+
+
+def test_shared_token_cache_skips_torn_and_long_records(tmp_path) -> None:
+    """
+    GIVEN shared cache with one full bucket
+    WHEN the first record is being written, a fifth token lands in the bucket,
+    and a user with a too long email is cached
+    THEN check torn record is a miss, the oldest record is evicted,
+    long email is not cached
+    """
+    cache = SharedTokenCache(str(tmp_path / "tokens.cache"), max_size=4, ttl=60)
+    assert cache.buckets == 1
+    expires_at = time.time() + 3600
+    for i in range(4):
+        cache.set(str(i), token_user(i, str(i)), i, expires_at)
+    memory = cache.open()
+    offset = cache._slots(cache._key("0"))[0]
+    VERSION.pack_into(memory, offset, VERSION.unpack_from(memory, offset)[0] + 1)
+    assert cache.get("0") is None
+    VERSION.pack_into(memory, offset, VERSION.unpack_from(memory, offset)[0] + 1)
+    assert cache.get("0") is not None
+    cache.set("4", token_user(4, "4"), 4, expires_at)
+    assert cache.get("0") is None
+    assert cache.get("3") is not None
+    assert cache.stats()["evictions"] == 1
+    cache.set("5", token_user(5, "5", "x" * 120 + "@example.com"), 5, expires_at)
+    assert cache.get("5") is None
+
+
+def test_shared_token_cache_layouts_use_own_files(tmp_path) -> None:
+    """
+    GIVEN shared cache in use and a cache of another size on the same path
+    WHEN both cache tokens, and a cache opens a file of another layout
+    THEN check the files differ, the cache in use keeps its tokens and
+    the file of another layout is refused, not truncated
+    """
+    path = str(tmp_path / "tokens.cache")
+    expires_at = int(time.time()) + 3600
+    old = SharedTokenCache(path, max_size=100, ttl=60)
+    old.set("a", token_user(1, "a"), 1, expires_at)
+    new = SharedTokenCache(path, max_size=1000, ttl=60)
+    new.set("b", token_user(2, "b"), 2, expires_at)
+    assert old.path != new.path
+    assert old.get("a") == token_user(1, "a")
+    with open(new.path, "r+b") as file:
+        file.write(b"XXXX")
+    size = os.path.getsize(new.path)
+    with pytest.raises(ValueError):
+        SharedTokenCache(path, max_size=1000, ttl=60).open()
+    assert os.path.getsize(new.path) == size
@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+import pytest
+import sqlalchemy
+from databases import Database
+from fastapi import HTTPException
+
+import authentication
+from cache import TokenCache
+from db import DatabaseRouter, InstrumentedDatabase, create_database
+from models.users import metadata
+
+
+@pytest.mark.asyncio
+async def test_sqlite_connection_pragma_profile(tmp_path) -> None:
+    """
+    GIVEN database created with the configured options
+    WHEN run a query
+    THEN check connection uses WAL, synchronous NORMAL and busy_timeout
+    """
+    database = create_database(f"sqlite:///{tmp_path / 'pragma.db'}")
+    await database.connect()
+    journal_mode = await database.fetch_val("PRAGMA journal_mode")
+    synchronous = await database.fetch_val("PRAGMA synchronous")
+    busy_timeout = await database.fetch_val("PRAGMA busy_timeout")
+    await database.disconnect()
+    assert journal_mode == "wal"
+    assert synchronous == 1
+    assert busy_timeout > 0
+
+
+@pytest.mark.asyncio
+async def test_pool_acquire_timeout(tmp_path) -> None:
+    """
+    GIVEN database with one connection slot held by a slow query
+    WHEN run another query
+    THEN check it fails with 503 after acquire timeout and is counted
+    """
+    database = InstrumentedDatabase(
+        Database(f"sqlite:///{tmp_path / 'pool.db'}"), max_size=1, acquire_timeout=0.05
+    )
+    await database.connect()
+    slow = asyncio.create_task(
+        database.fetch_val(
+            """WITH RECURSIVE numbers(n) AS (
+                SELECT 1 UNION ALL SELECT n + 1 FROM numbers WHERE n < 3000000
+            ) SELECT count(*) FROM numbers"""
+        )
+    )
+    await asyncio.sleep(0.01)
+    with pytest.raises(HTTPException) as error:
+        await database.fetch_val("SELECT 2")
+    assert database.stats()["in_use"] == 1
+    assert await slow == 3000000
+    await database.disconnect()
+    assert error.value.status_code == 503
+    assert database.stats()["timeouts"] == 1
+    assert database.stats()["in_use"] == 0
+
+
+@pytest.mark.asyncio
+async def test_router_reads_replicas_and_sticks_to_primary(tmp_path) -> None:
+    """
+    GIVEN router with a primary, a healthy and an unreachable replica
+    WHEN check replicas and read before and after a session write
+    THEN check reads go to the healthy replica, the writer reads from primary
+    """
+    primary = create_database(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_database(f"sqlite:///{tmp_path / 'replica.db'}")
+    broken = create_database(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    router = DatabaseRouter(
+        primary, [replica, broken], sticky_seconds=60, health_interval=1
+    )
+    await router.connect()
+    assert router.healthy == [replica]
+    assert router.reader("token") is replica
+    router.mark_write("token")
+    assert router.reader("token") is primary
+    assert router.reader("other_token") is replica
+    await router.disconnect()
+    assert router.stats()["primary_reads"] == 1
+    assert router.stats()["replica_reads"] == 2
+
+
+@pytest.mark.asyncio
+async def test_router_starts_without_unreachable_replica(tmp_path) -> None:
+    """
+    GIVEN router with a replica refusing connections
+    WHEN connect, then the replica comes up and replicas are checked
+    THEN check startup succeeds, the replica is healthy only after it responds
+    """
+    primary = create_database(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_database(f"sqlite:///{tmp_path / 'replica.db'}")
+
+    async def refuse() -> None:
+        raise OSError("Connection refused")
+
+    replica.connect = refuse
+    router = DatabaseRouter(primary, [replica], sticky_seconds=60, health_interval=1)
+    await router.connect()
+    assert router.healthy == []
+    assert router.reader() is primary
+    del replica.connect
+    await router.check_replicas()
+    assert router.healthy == [replica]
+    assert router.reader() is replica
+    await router.disconnect()
+
+
+def test_router_without_replicas_keeps_no_sessions(tmp_path) -> None:
+    """
+    GIVEN router without replicas
+    WHEN sessions write
+    THEN check no session is remembered
+    """
+    primary = create_database(f"sqlite:///{tmp_path / 'primary.db'}")
+    router = DatabaseRouter(primary, [], sticky_seconds=60, health_interval=1)
+    for i in range(100):
+        router.mark_write(f"token_{i}")
+    assert router.stats()["sticky_sessions"] == 0
+
+
+@pytest.mark.asyncio
+async def test_replica_token_reads_are_not_cached(tmp_path, monkeypatch) -> None:
+    """
+    GIVEN router with a replica holding a user renamed on the primary
+    WHEN fetch the user's token from the replica, then from the primary
+    THEN check the replica row is returned but only the primary row is cached
+    """
+    databases = []
+    for name, username in (("primary", "new"), ("replica", "old")):
+        url = f"sqlite:///{tmp_path / name}.db"
+        metadata.create_all(sqlalchemy.create_engine(url))
+        database = create_database(url)
+        await database.connect()
+        await database.execute(
+            """INSERT INTO users(id, email, username, password, verified, is_admin)
+            VALUES (1, 'user@example.com', :username, 'x', 1, 0)""",
+            values={"username": username},
+        )
+        await database.execute(
+            """INSERT INTO access_tokens(access_token, user_id, expires_at)
+            VALUES ('token', 1, :expires_at)""",
+            values={"expires_at": int(time.time() + 3600)},
+        )
+        databases.append(database)
+    primary, replica = databases
+    router = DatabaseRouter(primary, [replica], sticky_seconds=60, health_interval=1)
+    monkeypatch.setattr(authentication, "get_db_router", lambda: router)
+    monkeypatch.setattr(authentication, "token_cache", TokenCache(max_size=10, ttl=60))
+    found = await authentication.fetch_token_users(replica, ["token"])
+    assert found["token"].username == "old"
+    assert authentication.token_cache.get("token") is None
+    await authentication.fetch_token_users(primary, ["token"])
+    assert authentication.token_cache.get("token").username == "new"
+    await primary.disconnect()
+    await replica.disconnect()
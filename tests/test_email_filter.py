@@ -0,0 +1,80 @@
+import pytest
+from databases import Database
+
+from email_filter import EmailFilter, filter_size
+
+
+def make_filter(path: str) -> EmailFilter:
+    return EmailFilter(
+        path, capacity=1000, error_rate=0.01, rebuild_interval=0, enabled=True
+    )
+
+
+@pytest.mark.asyncio
+async def test_email_filter_shared_between_workers(tmp_path) -> None:
+    """
+    GIVEN two filters on one file, as two gunicorn workers, built from users
+    WHEN one of them adds a new email, then a user is deleted and it rebuilds
+    THEN check registered emails always pass, the other worker sees the new
+    email at once, unknown and deleted emails are rejected
+    """
+    database = Database(f"sqlite:///{tmp_path / 'users.db'}")
+    await database.connect()
+    await database.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+    emails = [f"user{i}@example.com" for i in range(200)]
+    await database.execute_many(
+        "INSERT INTO users(email) VALUES (:email)", [{"email": e} for e in emails]
+    )
+    first = make_filter(str(tmp_path / "emails.bloom"))
+    second = make_filter(str(tmp_path / "emails.bloom"))
+    # not built yet, every email may exist
+    assert first.open() is None and first.might_contain("nobody@example.com")
+    assert await first.rebuild(database)
+    second.open()
+    assert all(second.might_contain(email) for email in emails)
+    assert not second.might_contain("nobody@example.com")
+    first.add("new@example.com")
+    assert second.might_contain("new@example.com")
+    await database.execute("DELETE FROM users WHERE email = 'user0@example.com'")
+    await database.execute("INSERT INTO users(email) VALUES ('new@example.com')")
+    assert await second.rebuild(database)
+    await database.disconnect()
+    assert not first.might_contain("user0@example.com")
+    assert all(first.might_contain(email) for email in emails[1:])
+    assert first.might_contain("new@example.com")
+    first.close()
+    second.close()
+
+
+@pytest.mark.asyncio
+async def test_email_filter_rebuilds_on_worker_start(tmp_path) -> None:
+    """
+    GIVEN built filter and a user inserted outside the app
+    WHEN a worker starts
+    THEN check the worker finds the new user
+    """
+    database = Database(f"sqlite:///{tmp_path / 'users.db'}")
+    await database.connect()
+    await database.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT)")
+    first = make_filter(str(tmp_path / "emails.bloom"))
+    assert await first.rebuild(database)
+    await database.execute("INSERT INTO users(email) VALUES ('outside@example.com')")
+    assert not first.might_contain("outside@example.com")
+    worker = make_filter(str(tmp_path / "emails.bloom"))
+    worker.start(database)
+    await worker._task
+    await database.disconnect()
+    assert worker.might_contain("outside@example.com")
+    await worker.stop()
+    first.close()
+
+
+def test_filter_size() -> None:
+    """
+    GIVEN 1M emails at 1% false positives
+    WHEN size the filter
+    THEN check about 9.6M bits and 7 hashes
+    """
+    size, hashes = filter_size(1000000, 0.01)
+    assert 9500000 < size < 9700000
+    assert hashes == 7
@@ -0,0 +1,122 @@
+import asyncio
+import smtplib
+
+import pytest
+
+from email_service import EmailOutbox, LocalTransport, build_message
+
+
+class FlakyTransport(LocalTransport):
+    def __init__(self, failures: int) -> None:
+        super().__init__()
+        self.failures = failures
+
+    def send_batch(self, messages) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        super().send_batch(messages)
+
+
+class RefusingTransport(LocalTransport):
+    def __init__(self, refused: str) -> None:
+        super().__init__()
+        self.refused = refused
+        self.attempts = 0
+
+    def send_batch(self, messages) -> None:
+        self.attempts += 1
+        while messages:
+            if messages[0]["To"] == self.refused:
+                raise smtplib.SMTPRecipientsRefused(
+                    {self.refused: (550, b"No such user")}
+                )
+            self.sent.append(messages.pop(0))
+
+
+@pytest.mark.asyncio
+async def test_email_outbox_sends_queued_messages() -> None:
+    """
+    GIVEN email outbox with local transport
+    WHEN enqueue emails and stop the outbox
+    THEN check all emails are sent in order
+    """
+    transport = LocalTransport()
+    outbox = EmailOutbox(
+        transport, batch_size=2, max_retries=0, retry_backoff=0, queue_size=10
+    )
+    await outbox.start()
+    for i in range(5):
+        outbox.enqueue(build_message(str(i), f"user_{i}@gmail.com"))
+    await outbox.stop()
+    assert [msg["To"] for msg in transport.sent] == [
+        f"user_{i}@gmail.com" for i in range(5)
+    ]
+    assert outbox.sent == 5
+
+
+@pytest.mark.asyncio
+async def test_email_outbox_retries_failed_batch() -> None:
+    """
+    GIVEN email outbox with transport failing twice
+    WHEN enqueue email
+    THEN check email is sent after retries
+    """
+    transport = FlakyTransport(failures=2)
+    outbox = EmailOutbox(
+        transport, batch_size=10, max_retries=3, retry_backoff=0, queue_size=10
+    )
+    await outbox.start()
+    outbox.enqueue(build_message("1234", "pytest@gmail.com"))
+    await asyncio.sleep(0.1)
+    await outbox.stop()
+    assert len(transport.sent) == 1
+    assert outbox.failed == 0
+
+
+@pytest.mark.asyncio
+async def test_email_outbox_drops_only_refused_message() -> None:
+    """
+    GIVEN email outbox with transport refusing one recipient
+    WHEN enqueue a batch with the refused recipient in the middle
+    THEN check the other emails are sent without retries and one fails
+    """
+    transport = RefusingTransport("refused@gmail.com")
+    outbox = EmailOutbox(
+        transport, batch_size=10, max_retries=3, retry_backoff=10, queue_size=10
+    )
+    await outbox.start()
+    for to in ["first@gmail.com", "refused@gmail.com", "last@gmail.com"]:
+        outbox.enqueue(build_message("1234", to))
+    await outbox.stop()
+    assert [msg["To"] for msg in transport.sent] == [
+        "first@gmail.com",
+        "last@gmail.com",
+    ]
+    assert transport.attempts == 2
+    assert outbox.sent == 2
+    assert outbox.failed == 1
+
+
+def test_email_outbox_queue_follows_event_loop() -> None:
+    """
+    GIVEN email outbox created outside of an event loop, like at import
+    WHEN start and stop it in two event loops
+    THEN check emails are sent in both loops
+    """
+    transport = LocalTransport()
+    outbox = EmailOutbox(
+        transport, batch_size=2, max_retries=0, retry_backoff=0, queue_size=10
+    )
+
+    async def serve(to: str) -> None:
+        await outbox.start()
+        outbox.enqueue(build_message("1234", to))
+        await outbox.stop()
+
+    asyncio.run(serve("first@gmail.com"))
+    asyncio.run(serve("second@gmail.com"))
+    assert [msg["To"] for msg in transport.sent] == [
+        "first@gmail.com",
+        "second@gmail.com",
+    ]
@@ -0,0 +1,65 @@
+import gzip
+import json
+
+import pytest
+import sqlalchemy
+from databases import Database
+
+from exporter import export_users
+from models.users import metadata
+
+
+async def export_database(tmp_path) -> Database:
+    url = f"sqlite:///{tmp_path / 'export.db'}"
+    metadata.create_all(sqlalchemy.create_engine(url))
+    database = Database(url)
+    await database.connect()
+    await database.execute_many(
+        """INSERT INTO users(username, email, password, verified, is_admin)
+        VALUES (:username, :email, 'hash', :verified, 0)""",
+        [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "verified": i % 2}
+            for i in range(1, 8)
+        ],
+    )
+    return database
+
+
+async def collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+
+@pytest.mark.asyncio
+async def test_export_ndjson_filters_in_batches(tmp_path) -> None:
+    """
+    GIVEN users with every second one verified
+    WHEN export verified users with id <= 6 in batches of two
+    THEN check only matching rows and requested columns are exported in id order
+    """
+    database = await export_database(tmp_path)
+    body = await collect(
+        export_users(
+            database, ["email"], "ndjson", batch_size=2, verified=True, max_id=6
+        )
+    )
+    await database.disconnect()
+    assert [json.loads(line) for line in body.decode().splitlines()] == [
+        {"email": "user1@example.com"},
+        {"email": "user3@example.com"},
+        {"email": "user5@example.com"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_gzip_csv(tmp_path) -> None:
+    """
+    GIVEN users in the database
+    WHEN export csv with gzip from id 6
+    THEN check the stream is gzip of the header and the rows
+    """
+    database = await export_database(tmp_path)
+    body = await collect(
+        export_users(database, ["id", "username"], "csv", compress=True, min_id=6)
+    )
+    await database.disconnect()
+    assert gzip.decompress(body).decode() == "id,username\n6,user6\n7,user7\n"
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from hashing import HashingExecutor
+from password import (
+    BCRYPT_MIN_ROUNDS,
+    configure,
+    password_config,
+    password_hash,
+    verify_password,
+)
+
+
+@pytest.mark.asyncio
+async def test_hashing_process_pool_uses_parent_config() -> None:
+    """
+    GIVEN pwd_context configured with minimal bcrypt rounds in the parent
+    WHEN hash and verify a password in the process pool
+    THEN check pool processes hash with the parent rounds and verify the hash
+    """
+    original = dict(password_config)
+    configure(dict(original, scheme="bcrypt", bcrypt_rounds=BCRYPT_MIN_ROUNDS))
+    executor = HashingExecutor(pool_size=1, queue_size=4)
+    try:
+        executor.start()
+        hashed = await executor.run(password_hash, "password")
+        verified = await executor.run(verify_password, "password", hashed)
+    finally:
+        executor.shutdown()
+        configure(original)
+    assert hashed.startswith(f"$2b${BCRYPT_MIN_ROUNDS:02d}$")
+    assert verified is True
+    assert executor.stats()["calls"] == 2
+
+
+@pytest.mark.asyncio
+async def test_hashing_rejects_when_queue_is_full() -> None:
+    """
+    GIVEN executor with queue_size 1 busy with a slow call
+    WHEN submit another call
+    THEN check it is rejected with 503 and the slow call completes
+    """
+    executor = HashingExecutor(pool_size=0, queue_size=1)
+    slow = asyncio.create_task(executor.run(time.sleep, 0.2))
+    await asyncio.sleep(0.05)
+    with pytest.raises(HTTPException) as error:
+        await executor.run(time.sleep, 0)
+    await slow
+    executor.shutdown()
+    assert error.value.status_code == 503
+    assert executor.stats()["rejected"] == 1
+    assert executor.stats()["pending"] == 0
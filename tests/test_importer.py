@@ -0,0 +1,184 @@
+import asyncio
+import json
+import time
+
+import pytest
+import sqlalchemy
+from databases import Database
+
+from hashing import HashingExecutor
+from importer import UserImporter, aiter_lines
+from models.users import metadata
+from password import password_hash, verify_password
+
+
+async def lines(*rows: str):
+    for row in rows:
+        yield row
+
+
+async def import_database(tmp_path) -> Database:
+    url = f"sqlite:///{tmp_path / 'import.db'}"
+    metadata.create_all(sqlalchemy.create_engine(url))
+    database = Database(url)
+    await database.connect()
+    await database.execute(
+        """INSERT INTO users(username, email, password, verified, is_admin)
+        VALUES ('old', 'old@example.com', 'hash', 1, 0)"""
+    )
+    return database
+
+
+@pytest.mark.asyncio
+async def test_import_csv_hashes_and_reports_errors(tmp_path) -> None:
+    """
+    GIVEN csv with plain and hashed passwords, an existing email and invalid rows
+    WHEN import it in chunks of two
+    THEN check valid rows inserted with outbox events, rejected rows reported by
+    line, checkpoints saved
+    """
+    database = await import_database(tmp_path)
+    hashed = password_hash("secret")
+    checkpoints = []
+    importer = UserImporter(
+        database,
+        HashingExecutor(0, 10),
+        chunk_size=2,
+        concurrency=2,
+        on_checkpoint=checkpoints.append,
+    )
+    report = await importer.run(
+        lines(
+            "email,username,password,password_hash,verified\n",
+            "first@example.com,first,plain,,1\n",
+            f"second@example.com,second,,{hashed},0\n",
+            "old@example.com,old,plain,,0\n",
+            "bad-email,bad,plain,,0\n",
+            "fourth@example.com,fourth,,not-a-hash,0\n",
+            "third@example.com,third,,,0\n",
+        ),
+        "csv",
+    )
+    rows = await database.fetch_all(
+        "SELECT id, email, password, verified FROM users ORDER BY id"
+    )
+    events = await database.fetch_all("SELECT payload FROM outbox ORDER BY id")
+    await database.disconnect()
+    assert report["imported"] == 2
+    assert sorted(error["line"] for error in report["first_errors"]) == [4, 5, 6, 7]
+    assert report["last_line"] == 7
+    assert checkpoints == [3, 6, 7]
+    assert [row.email for row in rows] == [
+        "old@example.com",
+        "first@example.com",
+        "second@example.com",
+    ]
+    assert verify_password("plain", rows[1].password)
+    assert rows[1].verified == 1
+    assert rows[2].password == hashed
+    assert sorted(json.loads(event.payload)["registered"] for event in events) == [
+        rows[1].id,
+        rows[2].id,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_import_jsonl_resumes_after_checkpoint(tmp_path) -> None:
+    """
+    GIVEN jsonl body split across stream chunks
+    WHEN import it from start_line 1
+    THEN check the first line is skipped and the rest imported
+    """
+    database = await import_database(tmp_path)
+    hashed = password_hash("secret")
+    body = "".join(
+        json.dumps(
+            {
+                "email": f"user{i}@example.com",
+                "username": "user",
+                "password_hash": hashed,
+            }
+        )
+        + "\n"
+        for i in range(3)
+    ).encode()
+
+    async def chunks():
+        for start in range(0, len(body), 40):
+            yield body[start : start + 40]
+
+    importer = UserImporter(
+        database, HashingExecutor(0, 10), chunk_size=10, concurrency=2
+    )
+    report = await importer.run(aiter_lines(chunks()), "jsonl", start_line=1)
+    emails = await database.fetch_all("SELECT email FROM users ORDER BY id")
+    await database.disconnect()
+    assert report["imported"] == 2
+    assert report["errors"] == 0
+    assert [row.email for row in emails][1:] == [
+        "user1@example.com",
+        "user2@example.com",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_import_reports_email_registered_during_import(tmp_path) -> None:
+    """
+    GIVEN jsonl import and a registration of one of its emails while hashing
+    WHEN import it
+    THEN check only the inserted user is counted, the other is reported by line
+    """
+    database = await import_database(tmp_path)
+    importer = UserImporter(
+        database, HashingExecutor(0, 10), chunk_size=10, concurrency=2
+    )
+    hash_password = importer.hash_password
+
+    async def hash_while_registering(user):
+        if user.email == "race@example.com":
+            await database.execute(
+                """INSERT INTO users(username, email, password, verified, is_admin)
+                VALUES ('race', 'race@example.com', 'hash', 1, 0)"""
+            )
+        return await hash_password(user)
+
+    importer.hash_password = hash_while_registering
+    report = await importer.run(
+        lines(
+            json.dumps({"email": "race@example.com", "username": "a", "password": "p"}),
+            json.dumps({"email": "new@example.com", "username": "b", "password": "p"}),
+        ),
+        "jsonl",
+    )
+    usernames = await database.fetch_all("SELECT username FROM users ORDER BY id")
+    await database.disconnect()
+    assert report["imported"] == 1
+    assert report["first_errors"] == [
+        {"line": 1, "email": "race@example.com", "error": "Email already exists."}
+    ]
+    assert [row.username for row in usernames] == ["old", "race", "b"]
+
+
+@pytest.mark.asyncio
+async def test_import_waits_for_a_busy_hashing_executor(tmp_path) -> None:
+    """
+    GIVEN hashing executor with a full queue
+    WHEN import users with plain passwords
+    THEN check rows wait for the queue instead of being rejected
+    """
+    database = await import_database(tmp_path)
+    executor = HashingExecutor(0, 1)
+    busy = asyncio.create_task(executor.run(time.sleep, 0.1))
+    await asyncio.sleep(0.01)
+    importer = UserImporter(database, executor, chunk_size=10, concurrency=2)
+    rows = [
+        json.dumps({"email": f"user{i}@example.com", "username": "u", "password": "p"})
+        for i in range(3)
+    ]
+    report = await importer.run(lines(*rows), "jsonl")
+    await busy
+    executor.shutdown()
+    await database.disconnect()
+    assert report["imported"] == 3
+    assert report["errors"] == 0
+    assert executor.stats()["rejected"] == 0
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+from importtime import parse_importtime
+from settings import get_settings
+
+
+def test_settings_are_built_once() -> None:
+    """
+    GIVEN cached settings provider
+    WHEN get settings twice
+    THEN check the same instance is returned
+    """
+    assert get_settings() is get_settings()
+
+
+def test_parse_importtime() -> None:
+    """
+    GIVEN -X importtime output
+    WHEN parse it
+    THEN check module, self and cumulative times are read, the header skipped
+    """
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   json.decoder\n"
+        "import time:       300 |        420 | json\n"
+    )
+    assert parse_importtime(stderr) == [("json.decoder", 120, 120), ("json", 300, 420)]
+
+
+def test_app_import_skips_optional_integrations() -> None:
+    """
+    GIVEN fresh interpreter
+    WHEN import main
+    THEN check pika and smtplib are not imported, no database and no sync
+    engine is created
+    """
+    code = (
+        "import sys, main, db; "
+        "print(sorted({'pika', 'smtplib'} & set(sys.modules)), "
+        "db.get_db_router.cache_info().currsize, "
+        "db.get_engine.cache_info().currsize)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=dict(os.environ, TEST="test"),
+    )
+    assert result.stdout.splitlines()[-1] == "[] 0 0"
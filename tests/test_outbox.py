@@ -0,0 +1,48 @@
+import json
+from datetime import datetime
+
+import pika.exceptions
+import pytest
+import sqlalchemy
+
+from models.outbox import outbox
+from outbox import relay_batch
+
+
+class BrokenPublisher:
+    def __init__(self, fail_after: int) -> None:
+        self.fail_after = fail_after
+        self.sent = []
+
+    def publish_batch(self, messages) -> None:
+        while messages:
+            if len(self.sent) == self.fail_after:
+                raise pika.exceptions.AMQPConnectionError("Connection refused")
+            self.sent.append(messages.pop(0))
+
+
+def test_relay_batch_checkpoints_published_part(tmp_path) -> None:
+    """
+    GIVEN outbox with three events and a broker failing after two messages
+    WHEN relay a batch, then relay again after the broker is back
+    THEN check only the published events are removed, the rest is sent in order
+    """
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'outbox.db'}")
+    outbox.create(engine)
+    with engine.connect() as connection:
+        connection.execute(
+            outbox.insert(),
+            [
+                {"payload": json.dumps({"event": i}), "created_at": datetime.now()}
+                for i in range(3)
+            ],
+        )
+        publisher = BrokenPublisher(fail_after=2)
+        with pytest.raises(pika.exceptions.AMQPError):
+            relay_batch(connection, publisher, batch_size=10)
+        remaining = connection.execute(sqlalchemy.select(outbox.c.payload)).fetchall()
+        assert [json.loads(row.payload) for row in remaining] == [{"event": 2}]
+        publisher.fail_after = None
+        assert relay_batch(connection, publisher, batch_size=10) == 1
+        assert relay_batch(connection, publisher, batch_size=10) == 0
+    assert publisher.sent == [{"event": i} for i in range(3)]
@@ -0,0 +1,43 @@
+from passlib.context import CryptContext
+
+from password import (
+    BCRYPT_MAX_ROUNDS,
+    BCRYPT_MIN_ROUNDS,
+    calibrate_bcrypt_rounds,
+    configure,
+    password_config,
+    pwd_context,
+    verify_and_update,
+)
+
+
+def test_verify_and_update_rehashes_lower_cost() -> None:
+    """
+    GIVEN pwd_context configured with 11 bcrypt rounds
+    WHEN verify a 10 rounds hash and an 11 rounds hash
+    THEN check only the 10 rounds hash is rehashed with 11 rounds
+    """
+    original = dict(password_config)
+    configure(dict(original, scheme="bcrypt", bcrypt_rounds=11))
+    try:
+        old_hash = CryptContext(schemes=["bcrypt"]).hash("password", rounds=10)
+        verified, new_hash = verify_and_update("password", old_hash)
+        assert verified
+        assert new_hash.startswith("$2b$11$")
+        assert verify_and_update("password", new_hash) == (True, None)
+        assert verify_and_update("wrong", old_hash) == (False, None)
+    finally:
+        configure(original)
+    assert pwd_context.hash("password").startswith(
+        f"$2b${original['bcrypt_rounds']:02d}$"
+    )
+
+
+def test_calibrate_bcrypt_rounds() -> None:
+    """
+    GIVEN tiny and huge latency targets
+    WHEN calibrate bcrypt rounds
+    THEN check rounds are clamped to the supported range
+    """
+    assert calibrate_bcrypt_rounds(1) == BCRYPT_MIN_ROUNDS
+    assert calibrate_bcrypt_rounds(10**9) == BCRYPT_MAX_ROUNDS
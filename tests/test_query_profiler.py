@@ -0,0 +1,39 @@
+from query_profiler import QueryProfiler, fingerprint
+
+
+def test_fingerprint_normalizes_literals_and_binds() -> None:
+    """
+    GIVEN queries which differ only in literals, bind parameters and IN lists
+    WHEN fingerprint queries
+    THEN check fingerprints are equal and have no values
+    """
+    first = fingerprint(
+        "SELECT * FROM users\n  WHERE email = 'a@b.com' AND id IN (1, 2, 3)"
+    )
+    second = fingerprint("SELECT * FROM users WHERE email = :email AND id IN (7)")
+    assert first == second == "SELECT * FROM users WHERE email = ? AND id IN (...)"
+
+
+def test_profiler_top_and_slow_log(caplog) -> None:
+    """
+    GIVEN profiler with 10 ms slow query threshold
+    WHEN observe fast and slow queries
+    THEN check top fingerprints by total time, slow query logged without values
+    """
+    profiler = QueryProfiler(slow_query_ms=10, top_n=5, explain=False)
+    for _ in range(3):
+        profiler.observe(
+            "fetch_one", "SELECT * FROM users WHERE id = :id", {"id": 1}, 0.001, False
+        )
+    profiler.observe(
+        "fetch_one",
+        "SELECT * FROM users WHERE email = :email",
+        {"email": "secret@gmail.com"},
+        0.05,
+        False,
+    )
+    top = profiler.top()
+    assert top[0]["fingerprint"] == "SELECT * FROM users WHERE email = ?"
+    assert top[1]["calls"] == 3
+    assert "Slow query" in caplog.text
+    assert "secret@gmail.com" not in caplog.text
@@ -0,0 +1,69 @@
+import pytest
+from fastapi import HTTPException
+
+from ratelimit import MemoryBackend, RateLimiter, SQLiteBackend, parse_policy
+
+
+def test_memory_backend_sliding_window() -> None:
+    """
+    GIVEN limit of 3 requests per 60 seconds
+    WHEN hit the key at the start of a window, later in it and in the next one
+    THEN check 4th request is rejected, previous window decays in the next one
+    """
+    backend = MemoryBackend()
+    rules = [("login:ip:1.2.3.4", 3, 60)]
+    assert [backend.hit(rules, 600.0 + i) for i in range(3)] == [None] * 3
+    assert backend.hit(rules, 610.0) == pytest.approx(50.0)
+    # 3 * (1 - 30 / 60) + 1 = 2.5 < 3
+    assert backend.hit(rules, 690.0) is None
+    assert backend.hit(rules, 690.0) is None
+    assert backend.hit(rules, 690.0) == pytest.approx(10.0)
+
+
+def test_sqlite_backend_shared_between_workers(tmp_path) -> None:
+    """
+    GIVEN two SQLite backends on one file, as two gunicorn workers
+    WHEN hit the same key from both
+    THEN check both count against one limit
+    """
+    first = SQLiteBackend(str(tmp_path / "limits.db"))
+    second = SQLiteBackend(str(tmp_path / "limits.db"))
+    rules = [("login:email:a@b.com", 2, 60)]
+    assert first.hit(rules, 600.0) is None
+    assert second.hit(rules, 601.0) is None
+    assert first.hit(rules, 602.0) is not None
+    assert second.hit(rules, 602.0) is not None
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_rejects_with_retry_after() -> None:
+    """
+    GIVEN login policy of 2 attempts per email and 100 per ip
+    WHEN 3 logins for one email and 1 for another email from the same ip
+    THEN check 3rd attempt gets 429 with Retry-After, other email is allowed
+    """
+    limiter = RateLimiter(
+        MemoryBackend(), {"login": "ip:100/60,email:2/60"}, enabled=True
+    )
+    await limiter.check("login", "1.2.3.4", "a@b.com")
+    await limiter.check("login", "1.2.3.4", "A@b.com")
+    with pytest.raises(HTTPException) as error:
+        await limiter.check("login", "1.2.3.4", "a@b.com")
+    await limiter.check("login", "1.2.3.4", "c@d.com")
+    assert error.value.status_code == 429
+    assert int(error.value.headers["Retry-After"]) >= 1
+    assert limiter.rejected == 1
+
+
+def test_parse_policy() -> None:
+    """
+    GIVEN policy string
+    WHEN parse it
+    THEN check rules, unknown keys are rejected
+    """
+    assert parse_policy("ip:100/60, ip_email:5/60") == [
+        ("ip", 100, 60),
+        ("ip_email", 5, 60),
+    ]
+    with pytest.raises(ValueError):
+        parse_policy("user:1/60")
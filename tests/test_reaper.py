@@ -0,0 +1,50 @@
+import time
+
+import pytest
+from databases import Database
+
+from reaper import TokenReaper
+
+
+@pytest.mark.asyncio
+async def test_token_reaper_deletes_expired_tokens(tmp_path) -> None:
+    """
+    GIVEN 5 expired and 1 valid access tokens
+    WHEN run token reaper with batch size 2
+    THEN check only expired tokens are deleted, reclaimed rows counted
+    """
+    database = Database(f"sqlite:///{tmp_path / 'reaper.db'}")
+    await database.connect()
+    await database.execute(
+        """CREATE TABLE access_tokens (
+            access_token VARCHAR PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            expires_at BIGINT NOT NULL
+        )"""
+    )
+    query = """INSERT INTO access_tokens(access_token, user_id, expires_at)
+        VALUES (:access_token, :user_id, :expires_at)"""
+    for i in range(5):
+        await database.execute(
+            query=query,
+            values={
+                "access_token": f"expired_{i}",
+                "user_id": i,
+                "expires_at": int(time.time()) - 3600,
+            },
+        )
+    await database.execute(
+        query=query,
+        values={
+            "access_token": "valid",
+            "user_id": 10,
+            "expires_at": int(time.time()) + 3600,
+        },
+    )
+    reaper = TokenReaper(interval=0, batch_size=2)
+    reclaimed = await reaper.run_once(database)
+    rows = await database.fetch_all("SELECT access_token FROM access_tokens")
+    await database.disconnect()
+    assert reclaimed == 5
+    assert [row.access_token for row in rows] == ["valid"]
+    assert reaper.stats()["total_reclaimed"] == 5
@@ -0,0 +1,49 @@
+import json
+from datetime import datetime
+from typing import List
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models.users import TokenIntrospection
+from responses import JSONResponse, fast_response, get_response_class, run_coroutine
+
+
+def test_fast_response_matches_response_model_output() -> None:
+    """
+    GIVEN introspection rows with an active and an unknown token
+    WHEN serialize with fast_response and with response_model validation
+    THEN check both produce the same JSON
+    """
+    rows = [
+        {
+            "token": "a",
+            "active": True,
+            "id": 1,
+            "email": "user@example.com",
+            "username": "user",
+            "expiration_date": datetime(2030, 1, 2, 3, 4, 5, 678),
+        },
+        {
+            "token": "b",
+            "active": False,
+            "id": None,
+            "email": None,
+            "username": None,
+            "expiration_date": None,
+        },
+    ]
+    field = create_response_field(name="response", type_=List[TokenIntrospection])
+    expected = run_coroutine(serialize_response(field=field, response_content=rows))
+    response = fast_response(rows, headers={"X-Next-Cursor": "2"})
+    assert json.loads(response.body) == expected
+    assert response.headers["X-Next-Cursor"] == "2"
+
+
+def test_json_response_class_fallback() -> None:
+    """
+    GIVEN json response setting
+    WHEN get response class
+    THEN check standard JSONResponse is used
+    """
+    assert get_response_class("json") is JSONResponse
@@ -0,0 +1,66 @@
+import json
+
+import pika.exceptions
+import pytest
+
+from send import RabbitPublisher
+
+
+class FakeChannel:
+    def __init__(self, fail_after: int = -1) -> None:
+        self.fail_after = fail_after
+        self.is_closed = False
+        self.bodies = []
+
+    def basic_publish(self, exchange: str, routing_key: str, body: str) -> None:
+        if len(self.bodies) == self.fail_after:
+            self.is_closed = True
+            raise pika.exceptions.StreamLostError("Stream connection lost")
+        self.bodies.append((routing_key, json.loads(body)))
+
+
+def make_publisher(channels: list) -> RabbitPublisher:
+    publisher = RabbitPublisher("localhost", "users", retry_backoff=0)
+
+    def connect() -> None:
+        publisher._channel = channels.pop(0)
+
+    publisher._connect = connect
+    return publisher
+
+
+def test_rabbit_publisher_publishes_batch_in_order() -> None:
+    """
+    GIVEN publisher with a working channel
+    WHEN publish a batch twice
+    THEN check messages are published in order over one channel, batch emptied
+    """
+    channel = FakeChannel()
+    publisher = make_publisher([channel])
+    messages = [{"user": i} for i in range(3)]
+    publisher.publish_batch(messages)
+    publisher.publish_batch([{"user": 3}])
+    assert messages == []
+    assert channel.bodies == [("users", {"user": i}) for i in range(4)]
+    assert publisher.published == 4
+
+
+def test_rabbit_publisher_keeps_unpublished_and_reconnects() -> None:
+    """
+    GIVEN publisher with a channel lost after two messages
+    WHEN publish a batch, then publish the rest again
+    THEN check the error is raised with unpublished messages left in the batch,
+    the retry reconnects and publishes only them
+    """
+    lost = FakeChannel(fail_after=2)
+    channel = FakeChannel()
+    publisher = make_publisher([lost, channel])
+    messages = [{"user": i} for i in range(4)]
+    with pytest.raises(pika.exceptions.AMQPError):
+        publisher.publish_batch(messages)
+    assert messages == [{"user": 2}, {"user": 3}]
+    publisher.publish_batch(messages)
+    assert [body for _, body in lost.bodies + channel.bodies] == [
+        {"user": i} for i in range(4)
+    ]
+    assert publisher.published == 4
@@ -0,0 +1,66 @@
+import time
+from datetime import datetime
+
+import pytest
+import sqlalchemy
+from databases import Database
+
+from models.users import TokenUser, metadata
+from sessions import SessionExtender
+
+
+def token_user(token: str, expires_at: float) -> TokenUser:
+    return TokenUser(
+        id=1,
+        email="user@example.com",
+        username="user",
+        access_token=token,
+        expiration_date=datetime.fromtimestamp(expires_at),
+    )
+
+
+@pytest.mark.asyncio
+async def test_session_extension_is_coalesced_and_flushed(tmp_path) -> None:
+    """
+    GIVEN a token past the refresh point and a fresh token
+    WHEN touch them several times and flush
+    THEN check only the old token is extended, with one queued write
+    """
+    url = f"sqlite:///{tmp_path / 'sessions.db'}"
+    metadata.create_all(sqlalchemy.create_engine(url))
+    database = Database(url)
+    await database.connect()
+    now = time.time()
+    old_expires_at = int(now + 3600)
+    fresh_expires_at = int(now + 86000)
+    await database.execute_many(
+        """INSERT INTO access_tokens(access_token, user_id, expires_at)
+        VALUES (:access_token, :user_id, :expires_at)""",
+        [
+            {"access_token": "old", "user_id": 1, "expires_at": old_expires_at},
+            {"access_token": "fresh", "user_id": 2, "expires_at": fresh_expires_at},
+        ],
+    )
+    extender = SessionExtender(
+        lifetime=86400,
+        refresh_fraction=0.5,
+        flush_interval=0,
+        batch_size=10,
+        enabled=True,
+    )
+    for _ in range(3):
+        extender.touch(token_user("old", old_expires_at))
+        extender.touch(token_user("fresh", fresh_expires_at))
+    assert extender.stats()["pending"] == 1
+    assert await extender.flush(database) == 1
+    assert await extender.flush(database) == 0
+    rows = dict(
+        (row.access_token, row.expires_at)
+        for row in await database.fetch_all(
+            "SELECT access_token, expires_at FROM access_tokens"
+        )
+    )
+    await database.disconnect()
+    assert rows["old"] >= int(now + 86400)
+    assert rows["fresh"] == fresh_expires_at
+    assert extender.stats()["extended"] == 1
@@ -0,0 +1,109 @@
+import time
+
+from tokens import RevocationList, TokenSigner
+
+
+def make_signer(tmp_path) -> TokenSigner:
+    return TokenSigner(
+        {"default": b"secret", "new": b"new_secret"},
+        "new",
+        RevocationList(str(tmp_path / "revocations"), 1024),
+    )
+
+
+def test_signed_token_verify(tmp_path) -> None:
+    """
+    GIVEN signed token
+    WHEN verify token
+    THEN check claims: user id, email, username
+    """
+    signer = make_signer(tmp_path)
+    token = signer.sign(1, "pytest@gmail.com", "Pytest", time.time() + 60)
+    claims = signer.verify(token)
+    assert signer.is_signed(token)
+    assert claims["sub"] == 1
+    assert claims["email"] == "pytest@gmail.com"
+    assert claims["username"] == "Pytest"
+
+
+def test_signed_token_rejects_tampered_and_expired(tmp_path) -> None:
+    """
+    GIVEN tampered, expired and unknown key tokens
+    WHEN verify tokens
+    THEN check all of them are rejected
+    """
+    signer = make_signer(tmp_path)
+    token = signer.sign(1, "pytest@gmail.com", "Pytest", time.time() + 60)
+    kid, payload, signature = token.split(".")
+    assert signer.verify(f"{kid}.{payload}.{signature[::-1]}") is None
+    assert signer.verify(f"unknown.{payload}.{signature}") is None
+    assert signer.verify(signer.sign(1, "a@b.com", "a", time.time() - 1)) is None
+
+
+def test_signed_token_key_rotation(tmp_path) -> None:
+    """
+    GIVEN token signed with old key
+    WHEN active key id is rotated
+    THEN check old token is still verified
+    """
+    old_signer = TokenSigner(
+        {"default": b"secret"},
+        "default",
+        RevocationList(str(tmp_path / "revocations"), 1024),
+    )
+    token = old_signer.sign(1, "pytest@gmail.com", "Pytest", time.time() + 60)
+    assert make_signer(tmp_path).verify(token)["sub"] == 1
+
+
+def test_signed_token_revocation(tmp_path) -> None:
+    """
+    GIVEN signed tokens
+    WHEN revoke token and revoke all user tokens
+    THEN check revoked tokens are rejected
+    """
+    signer = make_signer(tmp_path)
+    token = signer.sign(1, "pytest@gmail.com", "Pytest", time.time() + 60)
+    other = signer.sign(2, "other@gmail.com", "Other", time.time() + 60)
+    signer.revoke(token)
+    assert signer.verify(token) is None
+    assert signer.verify(other) is not None
+    signer.revoke_user(2)
+    assert signer.verify(other) is None
+
+
+def test_revocations_are_shared_between_workers(tmp_path) -> None:
+    """
+    GIVEN two workers mapping the same revocation file
+    WHEN one worker revokes a user and a worker restarts
+    THEN check the other and the restarted worker reject old tokens, accept new ones
+    """
+    path = str(tmp_path / "revocations")
+    worker = make_signer(tmp_path)
+    other_worker = make_signer(tmp_path)
+    token = worker.sign(1, "pytest@gmail.com", "Pytest", time.time() + 60)
+    other_worker.revoke(token)
+    assert worker.verify(token) is None
+    restarted = TokenSigner(
+        {"default": b"secret", "new": b"new_secret"},
+        "new",
+        RevocationList(path, 1024),
+    )
+    assert restarted.verify(token) is None
+    new_token = worker.sign(1, "pytest@gmail.com", "Pytest", time.time() + 60)
+    assert restarted.verify(new_token)["sub"] == 1
+
+
+def test_signed_token_right_after_revocation(tmp_path, monkeypatch) -> None:
+    """
+    GIVEN user with a signed token, and a clock that does not move
+    WHEN revoke the user and sign a new token right away
+    THEN check the old token is rejected and the new one is verified
+    """
+    signer = make_signer(tmp_path)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    old = signer.sign(1, "pytest@gmail.com", "Pytest", now + 60)
+    signer.revoke_user(1)
+    new = signer.sign(1, "pytest@gmail.com", "Pytest", now + 60)
+    assert signer.verify(old) is None
+    assert signer.verify(new)["sub"] == 1
@@ -1,10 +1,12 @@
+import json
+
 import requests
 import pytest
 
-from settings import Settings
+from settings import Settings, get_settings
 from password import verify_password
 
-settings: Settings = Settings()
+settings: Settings = get_settings()
 
 
 def test_create_a_new_user(user_info, database) -> None:
@@ -169,6 +171,26 @@ def test_delete_user(user_token, database) -> None:
     assert r.status_code == 200
 
 
+def test_delete_user_outbox_event(user_token, database) -> None:
+    """
+    GIVEN delete current_user
+    WHEN DELETE "/users/user"
+    THEN check "deleted" event with user id is written to the outbox
+    """
+    r = requests.delete(
+        f"{settings.BACKEND}/users/user",
+        headers={"Authorization": "Bearer " + user_token["token"]},
+        timeout=5,
+    )
+    cur = database.cursor()
+    events = [
+        json.loads(row[0])
+        for row in cur.execute("SELECT payload FROM outbox ORDER BY id").fetchall()
+    ]
+    assert r.status_code == 200
+    assert {"deleted": r.json()["deleted"]} in events
+
+
 @pytest.mark.parametrize(
     "username,  email, password",
     [
@@ -276,6 +298,61 @@ def test_password_reset_confirm(confirmed_user, database) -> None:
     assert r.status_code == 200
 
 
+def test_email_reset_confirm(user_token, confirmed_user, database) -> None:
+    """
+    GIVEN email reset of current_user to a new email
+    WHEN POST "/users/email-confirm" with another email, the right one,
+    the used code again, and a code for a taken email
+    THEN check only the requested email is confirmed, once, taken email is 409
+    """
+    headers = {"Authorization": "Bearer " + user_token["token"]}
+    old_email = user_token["data"]["email"]
+    new_email = "pytest_new123@gmail.com"
+
+    def reset(email: str) -> int:
+        requests.post(
+            f"{settings.BACKEND}/users/email-reset",
+            json={"new_email": email},
+            headers=headers,
+            timeout=5,
+        )
+        return database.execute(
+            "SELECT verification_code FROM users WHERE email = ?", (old_email,)
+        ).fetchone()[0]
+
+    def confirm(email: str, code: int) -> requests.Response:
+        return requests.post(
+            f"{settings.BACKEND}/users/email-confirm",
+            json={"new_email": email, "code": str(code)},
+            headers=headers,
+            timeout=5,
+        )
+
+    taken = confirm(confirmed_user["email"], reset(confirmed_user["email"]))
+    code = reset(new_email)
+    other = confirm("victim@example.com", code)
+    r = confirm(new_email, code)
+    reused = confirm(new_email, code)
+    emails = [
+        row[0]
+        for row in database.execute(
+            "SELECT email FROM users WHERE email IN (?, ?)", (old_email, new_email)
+        )
+    ]
+    # the fixture removes the user by the old email
+    database.execute(
+        "UPDATE users SET email = ? WHERE email = ?", (old_email, new_email)
+    )
+    database.commit()
+    assert taken.status_code == 409
+    assert taken.json()["detail"] == "Email already exists."
+    assert other.status_code == 409
+    assert r.status_code == 200
+    assert r.json() == {"new_email": new_email}
+    assert reused.status_code == 409
+    assert emails == [new_email]
+
+
 def test_user_logout(user_token) -> None:
     """
     GIVEN current_user logout
@@ -297,3 +374,128 @@ def test_user_logout(user_token) -> None:
     assert r.status_code == 200
     assert r_body[user_token["data"]["email"]] == "logout"
     assert try_access.status_code == 401
+
+
+def test_list_users_keyset_pagination(user_token, confirmed_user) -> None:
+    """
+    GIVEN two users in database
+    WHEN GET "/users/list" with limit=1 and after_id from X-Next-Cursor
+    THEN check one user per page, pages don't overlap, no password in response
+    """
+    headers = {"Authorization": "Bearer " + user_token["token"]}
+    first = requests.get(
+        f"{settings.BACKEND}/users/list",
+        params={"limit": 1},
+        headers=headers,
+        timeout=5,
+    )
+    second = requests.get(
+        f"{settings.BACKEND}/users/list",
+        params={"limit": 1, "after_id": first.headers["X-Next-Cursor"]},
+        headers=headers,
+        timeout=5,
+    )
+    assert first.status_code == 200
+    assert len(first.json()) == 1
+    assert "password" not in first.json()[0]
+    assert second.json()[0]["id"] > first.json()[0]["id"]
+
+
+def test_list_users_ndjson_stream(user_token, confirmed_user) -> None:
+    """
+    GIVEN two users in database
+    WHEN GET "/users/list" with format=ndjson and fields=id,email
+    THEN check every line is a user with requested fields only
+    """
+    r = requests.get(
+        f"{settings.BACKEND}/users/list",
+        params={"format": "ndjson", "fields": "id,email"},
+        headers={"Authorization": "Bearer " + user_token["token"]},
+        timeout=5,
+    )
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert r.status_code == 200
+    assert {row["email"] for row in rows} >= {
+        user_token["data"]["email"],
+        confirmed_user["email"],
+    }
+    assert all(set(row) == {"id", "email"} for row in rows)
+
+
+def test_list_users_unknown_field(user_token) -> None:
+    """
+    GIVEN request users list with password field
+    WHEN GET "/users/list"
+    THEN check status_code == 422
+    """
+    r = requests.get(
+        f"{settings.BACKEND}/users/list",
+        params={"fields": "id,password"},
+        headers={"Authorization": "Bearer " + user_token["token"]},
+        timeout=5,
+    )
+    assert r.status_code == 422
+
+
+def test_check_tokens_batch(user_token) -> None:
+    """
+    GIVEN valid token with and without "Bearer " prefix and unknown token
+    WHEN POST "/users/check-tokens"
+    THEN check per-token validity in request order, user email for valid tokens
+    """
+    tokens = [user_token["token"], "fake_token", "Bearer " + user_token["token"]]
+    r = requests.post(
+        f"{settings.BACKEND}/users/check-tokens",
+        json={"tokens": tokens},
+        timeout=5,
+    )
+    r_body = r.json()
+    assert r.status_code == 200
+    assert [item["token"] for item in r_body] == tokens
+    assert [item["active"] for item in r_body] == [True, False, True]
+    assert r_body[0]["email"] == user_token["data"]["email"]
+    assert r_body[1]["email"] is None
+
+
+def test_metrics(user_token) -> None:
+    """
+    GIVEN authenticated request
+    WHEN GET "/metrics"
+    THEN check request latency per route template and query timings are exported
+    """
+    requests.get(
+        f"{settings.BACKEND}/users/user",
+        headers={"Authorization": "Bearer " + user_token["token"]},
+        timeout=5,
+    )
+    r = requests.get(f"{settings.BACKEND}/metrics", timeout=5)
+    assert r.status_code == 200
+    assert 'route="/users/user"' in r.text
+    assert "db_query_duration_seconds_count" in r.text
+
+
+def test_export_only_requested_fields(admin_token, user_token) -> None:
+    """
+    GIVEN admin and a user in database
+    WHEN GET "/users/export" with fields=email as non-admin and as admin
+    THEN check 403 for the user, admin gets every email and no other field
+    """
+    forbidden = requests.get(
+        f"{settings.BACKEND}/users/export",
+        params={"fields": "email"},
+        headers={"Authorization": "Bearer " + user_token["token"]},
+        timeout=5,
+    )
+    r = requests.get(
+        f"{settings.BACKEND}/users/export",
+        params={"fields": "email"},
+        headers={"Authorization": "Bearer " + admin_token["token"]},
+        timeout=5,
+    )
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert forbidden.status_code == 403
+    assert r.status_code == 200
+    assert all(list(row) == ["email"] for row in rows)
+    assert {admin_token["data"]["email"], user_token["data"]["email"]} <= {
+        row["email"] for row in rows
+    }
@@ -0,0 +1,196 @@
+import base64
+import fcntl
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, Optional
+
+from db import shared_file_path
+from settings import Settings, get_settings
+
+
+settings: Settings = get_settings()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def load_keys() -> Dict[str, bytes]:
+    """
+    Signing keys by key id, SECRET_KEY is always available as "default"
+    token_keys format: "kid1:secret1,kid2:secret2"
+    """
+    keys = {"default": settings.SECRET_KEY.encode()}
+    for item in settings.token_keys.split(","):
+        if ":" in item:
+            kid, secret = item.split(":", 1)
+            keys[kid.strip()] = secret.strip().encode()
+    return keys
+
+
+MAGIC: bytes = b"RVK1"
+# magic, user slots
+HEADER: struct.Struct = struct.Struct("<4sQ")
+HEADER_SIZE: int = 64
+USER_SLOT: struct.Struct = struct.Struct("<d")
+
+
+class RevocationList:
+    """
+    Revoked-at time per user in a file mmapped by all workers on the host
+    A signed token is revoked if issued at or before the revoked-at of its
+    user, so the file outlives worker and app restarts. Users sharing a slot
+    (user_id % slots) are revoked together, they only have to log in again.
+    """
+
+    def __init__(self, path: str, slots: int) -> None:
+        self.slots = max(1, slots)
+        self.path = shared_file_path(path, MAGIC, self.slots)
+        self._file: Any = None
+        self._map: Optional[mmap.mmap] = None
+        self._pid: Optional[int] = None
+
+    def open(self) -> mmap.mmap:
+        """
+        Map the file, once per process (gunicorn forks after import)
+        The layout is in the file name, a file in use is never resized.
+        """
+        if self._map is not None and self._pid == os.getpid():
+            return self._map
+        length = HEADER_SIZE + self.slots * USER_SLOT.size
+        expected = HEADER.pack(MAGIC, self.slots)
+        descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._file = os.fdopen(descriptor, "r+b")
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            if os.fstat(descriptor).st_size == 0:
+                self._file.truncate(length)
+                self._file.write(expected)
+                self._file.flush()
+            elif (
+                self._file.read(HEADER.size) != expected
+                or os.fstat(descriptor).st_size != length
+            ):
+                raise ValueError(f"{self.path} is not a revocation list of this layout")
+            self._map = mmap.mmap(descriptor, length)
+            self._pid = os.getpid()
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        return self._map
+
+    def _offset(self, user_id: int) -> int:
+        return HEADER_SIZE + user_id % self.slots * USER_SLOT.size
+
+    def revoke_user(self, user_id: int) -> None:
+        """
+        Revoke every token of the user issued up to now
+        """
+        revocations = self.open()
+        offset = self._offset(user_id)
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            revoked_at = max(USER_SLOT.unpack_from(revocations, offset)[0], time.time())
+            USER_SLOT.pack_into(revocations, offset, revoked_at)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def revoked_at(self, user_id: int) -> float:
+        revocations = self.open()
+        return USER_SLOT.unpack_from(revocations, self._offset(user_id))[0]
+
+    def is_revoked(self, user_id: int, issued_at: float) -> bool:
+        return issued_at <= self.revoked_at(user_id)
+
+
+class TokenSigner:
+    """
+    Stateless access tokens: "<kid>.<payload>.<signature>"
+    payload - sub (user id), email, username, iat, exp
+    """
+
+    def __init__(
+        self, keys: Dict[str, bytes], key_id: str, revoked: RevocationList
+    ) -> None:
+        if key_id not in keys:
+            raise ValueError(f"Unknown token key id: {key_id}")
+        self.keys = keys
+        self.key_id = key_id
+        self.revoked = revoked
+
+    @staticmethod
+    def is_signed(token: str) -> bool:
+        return token.count(".") == 2
+
+    def _sign(self, key: bytes, message: str) -> str:
+        return _b64encode(hmac.new(key, message.encode(), hashlib.sha256).digest())
+
+    def sign(self, user_id: int, email: str, username: str, expires_at: float) -> str:
+        # issued after the last revocation even if the clock has not moved
+        issued_at = max(time.time(), self.revoked.revoked_at(user_id) + 1e-6)
+        payload = {
+            "sub": user_id,
+            "email": email,
+            "username": username,
+            "iat": issued_at,
+            "exp": int(expires_at),
+        }
+        message = (
+            f"{self.key_id}."
+            f"{_b64encode(json.dumps(payload, separators=(',', ':')).encode())}"
+        )
+        return f"{message}.{self._sign(self.keys[self.key_id], message)}"
+
+    def verify(self, token: str) -> Optional[dict]:
+        """
+        Return token claims or None for invalid, expired or revoked tokens
+        """
+        try:
+            kid, payload, signature = token.split(".")
+        except ValueError:
+            return None
+        key = self.keys.get(kid)
+        if key is None:
+            return None
+        expected = self._sign(key, f"{kid}.{payload}")
+        if not hmac.compare_digest(expected, signature):
+            return None
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        if claims["exp"] <= time.time():
+            return None
+        if self.revoked.is_revoked(claims["sub"], claims["iat"]):
+            return None
+        return claims
+
+    def revoke(self, token: str) -> None:
+        """
+        A user has one access token at a time, revoke it with the user
+        """
+        claims = self.verify(token)
+        if claims is not None:
+            self.revoked.revoke_user(claims["sub"])
+
+    def revoke_user(self, user_id: int) -> None:
+        self.revoked.revoke_user(user_id)
+
+
+token_signer: TokenSigner = TokenSigner(
+    load_keys(),
+    settings.token_key_id,
+    RevocationList(settings.token_revocation_path, settings.token_revocation_slots),
+)
+
+
+def signed_tokens_enabled() -> bool:
+    return settings.token_mode == "signed"